@@ -0,0 +1,108 @@
+#! /bin/bash
+
+# check of the AVSPEAKD scorer (envs/etc/AVSPEAKD/eval_AVSPKD_testset.py):
+# the frame engine, the frame engine in a process pool and the interval
+# engine must give the same scores, threshold sweep and breakdown, with and
+# without a collar, on random hypothesis/reference pairs and on the corner
+# cases below; prints a line for each run and exits with 1 on a mismatch
+
+# -----------
+# manage args
+# -----------
+
+show_help() {
+  cat << EOF
+ARGS: [-h] [-n pairs]
+  where
+      -h        print help
+      -n        number of random hypothesis/reference pairs (default 6)
+EOF
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+pairs=6
+
+while getopts "hn:" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    n)
+      pairs=$OPTARG
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/evaluate.USE
+
+exe=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/AVSPEAKD/eval_AVSPKD_testset.py
+
+tmpPrefix=/tmp/rAvc.$$
+trap "rm -rf ${tmpPrefix}.*" EXIT
+dataDir=${tmpPrefix}.data
+mkdir -p $dataDir
+
+# corner case: the run of the 0.9 score is all inside the collar (-c 0.12)
+# of the reference segment start, so its score has no frames
+printf 'v\t0.96\t1.04\ts\t0.9\nv\t0.0\t3.0\ts\t0.2\n' > $dataDir/hyp0.tsv
+printf 'v\t1.0\t2.0\ts\t1\nv\t0.0\t3.0\ts\t0\n' > $dataDir/ref0.tsv
+
+python3 - $dataDir $pairs << EOF
+import sys, random
+dataDir, pairs = sys.argv[1], int(sys.argv[2])
+for n in range(1, pairs + 1):
+    for kind in ("hyp", "ref"):
+        rng = random.Random(f'{kind}{n}')
+        with open(f'{dataDir}/{kind}{n}.tsv', "w") as fp:
+            for v in range(3):
+                for s in range(3):
+                    t = rng.uniform(0, 3)
+                    for k in range(12):
+                        end = t + rng.uniform(0.01, 4)
+                        if kind == "hyp":
+                            label = rng.choice([0, 1, 0.5, round(rng.random(), 2)])
+                        else:
+                            label = rng.choice([0, 1, 1])
+                        fp.write(f'vid{v}\t{t:.3f}\t{end:.3f}\tspk{s}\t{label}\n')
+                        t = end + rng.uniform(-1, 2)
+EOF
+
+failed=0
+for n in $(seq 0 $pairs) ; do
+  for collar in 0 0.12 0.5 ; do
+    resList=""
+    for runArgs in "-e frames" "-e frames -j 2" "-e intervals" ; do
+      out=${tmpPrefix}.out
+      python3 $exe $runArgs -c $collar -t 0.3,0.5,0.7 -b $out.breakdown \
+        $dataDir/hyp$n.tsv $dataDir/ref$n.tsv > $out || { echo "$n -c $collar $runArgs: failed" ; exit 1 ; }
+      # NaN is not valid json for a strict parser
+      res=$(python3 -c 'import sys, json
+c = lambda x: (_ for _ in ()).throw(ValueError(x))
+r = json.load(open(sys.argv[1]), parse_constant=c)
+r["breakdown"] = json.load(open(sys.argv[2]), parse_constant=c)
+print(json.dumps(r, sort_keys=True))' $out $out.breakdown) || res=INVALID
+      resList="$resList$res"$'\n'
+    done
+    if test $(printf '%s' "$resList" | sort -u | wc -l) -ne 1 || test "$res" = INVALID
+    then
+      echo "pair $n -c $collar: MISMATCH"
+      failed=1
+    else
+      echo "pair $n -c $collar: $(printf '%s' "$res" | python3 -c 'import sys, json; print(json.dumps(json.load(sys.stdin)["scores"]))')"
+    fi
+  done
+done
+
+if test $failed -ne 0
+then
+  echo "FAILED"
+  exit 1
+fi
+echo "OK"
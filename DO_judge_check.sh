@@ -0,0 +1,67 @@
+#! /bin/bash
+
+# check of the SQA judge pipeline (run-SQA-accuracy.py) against the local
+# stand-in of the judge API (see DO_judge_load_test.sh): the accuracy must
+# not depend on the number of requests in flight, on the paragraph
+# batching nor on the client of the judge API, also with server errors and rate limits (that are retried);
+# prints the scores of each run and exits with 1 on a mismatch
+
+# -----------
+# manage args
+# -----------
+
+show_help() {
+  cat << EOF
+ARGS: [-h] [-n questions] [-c concurrency]
+  where
+      -h        print help
+      -n        number of synthetic questions (default 200)
+      -c        max number of judge requests in flight of the concurrent runs (default 16)
+EOF
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+questions=200
+concurrency=16
+
+while getopts "hn:c:" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    n)
+      questions=$OPTARG
+      ;;
+    c)
+      concurrency=$OPTARG
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+loadTest=$(dirname $(readlink -f $0))/DO_judge_load_test.sh
+
+# no malformed outputs: they are drawn at random per request, so they
+# would change the accuracy from run to run
+conditions="-n $questions -l 0.02 -e 0.05 -r 0.05"
+
+accuracyList=""
+for runArgs in "-c 1" "-c $concurrency" "-b -c $concurrency" "-k openai -c $concurrency" ; do
+  res=$($loadTest $conditions $runArgs) || { echo "load test $runArgs failed" ; exit 1 ; }
+  accuracy=$(printf '%s' "$res" | python3 -c 'import sys, json; print(json.load(sys.stdin)["scores"]["accuracy"])')
+  echo "$runArgs: $res"
+  accuracyList="$accuracyList $accuracy"
+done
+
+if test $(echo $accuracyList | tr ' ' '\n' | sort -u | wc -l) -ne 1
+then
+  echo "FAILED: accuracy$accuracyList"
+  exit 1
+fi
+echo "OK: accuracy$accuracyList"
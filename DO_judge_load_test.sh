@@ -0,0 +1,146 @@
+#! /bin/bash
+
+# load test of the SQA judge pipeline (run-SQA-accuracy.py) against the
+# local stand-in of the judge API (envs/etc/SQA-accuracy/judge_stand_in.py):
+# measures the throughput and the retries of a given concurrency under the
+# simulated latency, errors and rate limits; no API key or network needed
+
+# -----------
+# manage args
+# -----------
+
+show_help() {
+  cat << EOF
+ARGS: [-h] [-v] [-b] [-k client] [-n questions] [-c concurrency] [-l latency] [-e errorRate] [-r rateLimitRate] [-q requestsPerMinute] [-m malformedRate]
+  where
+      -h        print help
+      -v        verbose
+      -b        judge all the questions of a paragraph in a single request
+      -k        client of the judge API, groq or openai (default groq)
+      -n        number of synthetic questions (default 1000)
+      -c        max number of judge requests in flight (default 8)
+      -l        mean latency of the stand-in in seconds (default 0.2)
+      -e        fraction of requests failing with a 500 error (default 0)
+      -r        fraction of requests failing with a 429 error (default 0)
+      -q        max requests per minute of the stand-in, 429 over it (default 0, no limit)
+      -m        fraction of requests with a non-JSON judge output (default 0)
+EOF
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+verbose=0
+debugInfo=""
+batch=""
+client=groq
+questions=1000
+concurrency=8
+latency=0.2
+errorRate=0
+rateLimitRate=0
+requestsPerMinute=0
+malformedRate=0
+
+while getopts "hvbk:n:c:l:e:r:q:m:" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    v)
+      verbose=1
+      debugInfo='-d'
+      ;;
+    b)
+      batch='-b'
+      ;;
+    k)
+      client=$OPTARG
+      ;;
+    n)
+      questions=$OPTARG
+      ;;
+    c)
+      concurrency=$OPTARG
+      ;;
+    l)
+      latency=$OPTARG
+      ;;
+    e)
+      errorRate=$OPTARG
+      ;;
+    r)
+      rateLimitRate=$OPTARG
+      ;;
+    q)
+      requestsPerMinute=$OPTARG
+      ;;
+    m)
+      malformedRate=$OPTARG
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/groq.USE
+
+sqaDir=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/SQA-accuracy
+standIn=$sqaDir/judge_stand_in.py
+exe=$sqaDir/run-SQA-accuracy.py
+
+tmpPrefix=/tmp/rJlt.$$
+dataDir=${tmpPrefix}.data
+outTmp=${tmpPrefix}.out
+tmpScores=${tmpPrefix}.scores
+tmpErr=${tmpPrefix}.err
+port=$((20000 + $$ % 10000))
+url=http://127.0.0.1:$port
+
+python3 $standIn --write-dataset $dataDir --dataset-questions $questions || exit 1
+
+python3 $standIn --port $port --latency $latency --error-rate $errorRate \
+  --rate-limit-rate $rateLimitRate --requests-per-minute $requestsPerMinute \
+  --malformed-rate $malformedRate 2> /dev/null &
+standInPid=$!
+trap "kill $standInPid 2> /dev/null ; rm -rf ${tmpPrefix}.*" EXIT
+
+# wait for the stand-in
+for i in $(seq 50) ; do
+  python3 -c "import urllib.request; urllib.request.urlopen('$url/stats')" 2> /dev/null && break
+  sleep 0.2
+done
+
+# the stand-in serves the paths of both clients (see judge_stand_in.py)
+judgeUrl=$url
+if test "$client" = openai ; then judgeUrl=$url/v1 ; fi
+
+# the judge client needs a key, any key
+export STAND_IN_API_KEY=stand-in
+
+startTime=$(date +%s.%N)
+python3 $exe $debugInfo $batch -t -c $concurrency --judge-client $client --judge-base-url $judgeUrl --judge-api-key-env STAND_IN_API_KEY \
+  -p $dataDir/hyp.json -r $dataDir/ref.json -o $outTmp 2> $tmpErr 1> $tmpScores
+exitCode=$?
+endTime=$(date +%s.%N)
+if test $verbose -eq 1 ; then cat $tmpErr 1>&2 ; fi
+if test $exitCode != 0 ; then echo run-SQA-accuracy.py failed ; exit 1 ; fi
+
+python3 - $url $startTime $endTime $questions $concurrency $tmpScores << EOF
+import sys, json, urllib.request
+url, startTime, endTime, questions, concurrency, scoresFile = sys.argv[1:]
+seconds = float(endTime) - float(startTime)
+stats = json.load(urllib.request.urlopen(url + "/stats"))
+print(json.dumps({
+    "questions": int(questions),
+    "concurrency": int(concurrency),
+    "seconds": round(seconds, 3),
+    "questions_per_second": round(int(questions) / seconds, 3),
+    "requests_per_question": round(stats["requests"] / int(questions), 3),
+    "retried_requests": stats["rate_limited"] + stats["errors"],
+    "scores": json.load(open(scoresFile)),
+    "stand_in": stats}))
+EOF
@@ -0,0 +1,68 @@
+#! /bin/bash
+
+# pre-stage in the local model registry all the models used by the metrics
+# (see envs/etc/model_registry.py); run it on a node with network access
+# (e.g. the login node) every time a model is added or updated; once the
+# registry exists the metrics run offline, so it must hold every model they
+# load (e.g. the BERTScore model of every MCIF/IWSLT IF target language,
+# BertscoreLangs in model_registry.py)
+
+# -----------
+# manage args
+# -----------
+
+show_help() {
+  cat << EOF2
+ARGS: [-h] [-v]
+  where
+      -h        print help
+      -v        verify the checksums of the registered models (no download)
+EOF2
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+verifyOnly=0
+
+while getopts "hv" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    v)
+      verifyOnly=1
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+exe=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/model_registry.py
+
+if test $verifyOnly -eq 1
+then
+  python3 $exe verify
+  exit $?
+fi
+
+export MODEL_REGISTRY_WARMUP=1
+
+# UTMOS
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/speechmos.USE
+python $exe -d warmup utmos || exit 1
+
+# whisper (TTS pipeline)
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/tts.USE
+python $exe -d warmup whisper -m large || exit 1
+
+# COMET and BERTScore (MCIF and IWSLT IF)
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/mcif.USE
+python $exe -d warmup comet -m Unbabel/wmt22-comet-da || exit 1
+# all the languages of BertscoreLangs
+python $exe -d warmup bertscore || exit 1
+
+python $exe verify
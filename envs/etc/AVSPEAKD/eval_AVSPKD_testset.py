@@ -3,52 +3,80 @@
 import sys
 import argparse
 import json
-import csv
+import heapq
+from operator import methodcaller
 import numpy as np
-from sklearn.metrics import average_precision_score, precision_recall_curve, precision_score,  recall_score, f1_score
+from concurrent.futures import ProcessPoolExecutor
 
 
 def debug(msg):
     if DebugFlag:
         print(f'{msg}', file=sys.stderr)
 
+def internStrings(strList):
+    # the integer code of each string (codes given in order of first
+    # appearance) and the list of the distinct strings
+    codeDict = {}
+    codes = np.fromiter((codeDict.setdefault(x, len(codeDict)) for x in strList),
+                        dtype=np.int64, count=len(strList))
+    return codes, list(codeDict)
+
+
 def loadTsvEntries(tsvFile, is_hypothesis=True):
+    # columnar loader: the 5 columns (video, start, end, speaker, label) are
+    # parsed in bulk into typed arrays and then grouped by (video, speaker)
+    #
+    # { $VIDEO : { $SPK : ( $START_FRAMES, $END_FRAMES, $LABELS ) } }
+    #
+    # the frames are int32 indexes of the 25 FPS frame grid, the labels are
+    # float32 (hypothesis) or int8 (reference); the entries of a speaker keep
+    # the order of the file
     entryDict = {}
     try:
         with open(tsvFile, "r") as f:
-            ## rd = csv.reader(f, delimiter="\t", quotechar='"')
-            rd = csv.reader(f, delimiter="\t")
-            for row in rd:
-                videoId = row[0]
-                # time_stamp_start
-                tsStart = discretizeTimeStampTo25FPS(float(row[1]))
-                # time_stamp_end
-                tsEnd = discretizeTimeStampTo25FPS(float(row[2]))
-                spkID = row[3]
-                label = row[4]
-                fVal = float(label)
-                iVal = int(fVal)
-                if is_hypothesis:
-                    # could be the label 0|1 or a confidence score <= 1.0
-                    if abs(fVal - iVal) < 0.001:
-                        label = iVal
-                    else:
-                        label = fVal
-                else:
-                    # the label 0|1
-                    label = iVal
-
-                ## debug(f'   processing {videoId} {spkID} {tsStart} {tsEnd} {label}')
-                if videoId in entryDict:
-                    if spkID in entryDict[videoId]:
-                        l = entryDict[videoId][spkID]
-                        l.append([tsStart, tsEnd, label])
-                        entryDict[videoId][spkID] = l
-                    else:
-                        entryDict[videoId][spkID] = [ [tsStart, tsEnd, label] ]
-                else:
-                    entryDict[videoId] = {}
-                    entryDict[videoId][spkID] = [ [tsStart, tsEnd, label] ]
+            lineList = f.read().splitlines()
+        if not lineList:
+            return entryDict
+        if set(map(methodcaller("count", "\t"), lineList)) == {4}:
+            # split all the fields at once and take every 5th one
+            fieldList = "\t".join(lineList).split("\t")
+            columns = [fieldList[i::5] for i in range(5)]
+        else:
+            rowList = [line.split("\t") for line in lineList]
+            badList = [i + 1 for i, row in enumerate(rowList) if len(row) < 5]
+            if badList:
+                raise ValueError(f'{tsvFile}: less than 5 columns at line {badList[0]}')
+            columns = [[row[i] for row in rowList] for i in range(5)]
+            del rowList
+        del lineList
+        videoCodes, videoList = internStrings(columns[0])
+        spkCodes, spkList = internStrings(columns[3])
+        # time_stamp_start and time_stamp_end (as indexes of the 25 FPS frame grid)
+        tsStart = timeStampToFrame(np.array(columns[1], dtype=np.float64))
+        tsEnd = timeStampToFrame(np.array(columns[2], dtype=np.float64))
+        fVal = np.array(columns[4], dtype=np.float64)
+        iVal = np.trunc(fVal)
+        if is_hypothesis:
+            # could be the label 0|1 or a confidence score <= 1.0
+            labels = np.where(np.abs(fVal - iVal) < 0.001, iVal, fVal).astype(np.float32)
+        else:
+            # the label 0|1
+            labels = iVal.astype(np.int8)
+        del columns
+
+        # group by (video, speaker): the stable sort keeps the file order
+        # inside each group
+        key = videoCodes * len(spkList) + spkCodes
+        order = np.argsort(key, kind='stable')
+        groupStart = np.flatnonzero(np.r_[True, np.diff(key[order]) != 0])
+        groupEnd = np.r_[groupStart[1:], len(order)]
+        # the groups of each video in order of first appearance of the speaker
+        firstRow = order[groupStart]
+        for g in np.lexsort((firstRow, videoCodes[firstRow])).tolist():
+            idx = order[groupStart[g]:groupEnd[g]]
+            videoId = videoList[videoCodes[idx[0]]]
+            spkID = spkList[spkCodes[idx[0]]]
+            entryDict.setdefault(videoId, {})[spkID] = (tsStart[idx], tsEnd[idx], labels[idx])
     except Exception as e:
         print(json.dumps({
             "state": "ERROR",
@@ -59,51 +87,49 @@ def loadTsvEntries(tsvFile, is_hypothesis=True):
     return entryDict
 
 
+# the entries of a speaker missing in a file
+NoEntries = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+
+
 def debugEntries(entryDict):
     for videoId,d in entryDict.items():
         debug(f'  {videoId}')
-        for spkId,eList in d.items():
+        for spkId,entries in d.items():
             debug(f'    {spkId}')
-            for l in eList:
-                debug(f'      {l}')
+            for l in zip(*[a.tolist() for a in entries]):
+                debug(f'      {list(l)}')
 
 
-def discretizeTimeStampTo25FPS(ts):
+def timeStampToFrame(ts):
+    # round the time stamps (array, in seconds) to the nearest 40 ms
+    # boundary and return them as indexes of the 25 FPS frame grid (frame i
+    # covers the interval [i * 0.04, (i + 1) * 0.04])
     baseTimeMs = 40
-    intPartSec = int(ts)
-    fractPartMs = int((ts % 1) * 1000)
-    f1 = int(fractPartMs / 40) * 40
-    f2 = (int(fractPartMs / 40) + 1) * 40
-    if (f2 - fractPartMs) < (fractPartMs - f1):
-        return intPartSec + f2 / 1000
-    else:
-        return intPartSec + f1 / 1000
+    intPartSec = np.trunc(ts)
+    fractPartMs = np.trunc(np.mod(ts, 1) * 1000)
+    f1 = np.trunc(fractPartMs / baseTimeMs)
+    f2 = f1 + 1
+    frame = np.where((f2 * baseTimeMs - fractPartMs) < (fractPartMs - f1 * baseTimeMs), f2, f1)
+    return (intPartSec * 25 + frame).astype(np.int32)
+
+
 
-    
 def getInfoDictFromEntries(entryDict):
     #
-    # { $VIDEO : { "minTs": $MIN_TIME_STAMP,
-    #              "maxTs": $MAX_TIME_STAMP,
+    # { $VIDEO : { "minFrame": $MIN_FRAME,
+    #              "maxFrame": $MAX_FRAME,
     #              "speakers": [ $SPK1, $SPK2, .. , $SPKn ]
     #            }
     # }
     infoDict = {}
-    # get min and max timestamps
+    # get min and max frames
     for videoId,d in entryDict.items():
         infoDict[videoId] = {}
         infoDict[videoId]["speakers"] = list(d.keys())
-        minTS = 99e99
-        maxTS = -1
-        for spkId,eList in d.items():
-            for entry in eList:
-                tsStart = entry[0]
-                if tsStart < minTS:
-                    minTS = tsStart
-                tsEnd = entry[1]
-                if tsEnd > maxTS:
-                    maxTS = tsEnd
-        infoDict[videoId]["minTs"] = minTS
-        infoDict[videoId]["maxTs"] = maxTS
+        minFrame = min(int(tsStart.min()) for tsStart, _, _ in d.values())
+        maxFrame = max(int(tsEnd.max()) for _, tsEnd, _ in d.values())
+        infoDict[videoId]["minFrame"] = minFrame
+        infoDict[videoId]["maxFrame"] = maxFrame
     return infoDict
 
 
@@ -117,19 +143,19 @@ def getGlobalInfoDict(infoDict1, infoDict2):
     for videoId in infoDict2.keys():
         videoDict[videoId] = 1
     #
-    # for each video compute the speaker, the minTs and the maxTS
+    # for each video compute the speaker, the minFrame and the maxFrame
     for videoId in videoDict.keys():
         if videoId in infoDict1:
-            min1 = infoDict1[videoId]["minTs"]
-            max1 = infoDict1[videoId]["maxTs"]
+            min1 = infoDict1[videoId]["minFrame"]
+            max1 = infoDict1[videoId]["maxFrame"]
             spkL1 = infoDict1[videoId]["speakers"]
         else:
             min1 = 99e99
             max1 = -1
             spkL1 = []
         if videoId in infoDict2:
-            min2 = infoDict2[videoId]["minTs"]
-            max2 = infoDict2[videoId]["maxTs"]
+            min2 = infoDict2[videoId]["minFrame"]
+            max2 = infoDict2[videoId]["maxFrame"]
             spkL2 = infoDict2[videoId]["speakers"]
         else:
             min2 = 99e99
@@ -138,94 +164,350 @@ def getGlobalInfoDict(infoDict1, infoDict2):
         #
         gInfoDict[videoId] = {}
         # join the two speaker lists without duplicates
-        spkLG = list(spkL1)
-        spkLG.extend(x for x in spkL2 if x not in spkLG)
-        gInfoDict[videoId]["speakers"] = spkLG
+        gInfoDict[videoId]["speakers"] = list(dict.fromkeys(spkL1 + spkL2))
         if min1 < min2:
-            gInfoDict[videoId]["minTs"] = min1
+            gInfoDict[videoId]["minFrame"] = min1
         else:
-            gInfoDict[videoId]["minTs"] = min2
+            gInfoDict[videoId]["minFrame"] = min2
         if max1 > max2:
-            gInfoDict[videoId]["maxTs"] = max1
+            gInfoDict[videoId]["maxFrame"] = max1
         else:
-            gInfoDict[videoId]["maxTs"] = max2
+            gInfoDict[videoId]["maxFrame"] = max2
     #
     return gInfoDict
 
 
-def isIntervalContained(interval, entryL):
-    # interval = [ start_time, end_time ]
-    # entryL = [ [ start_time, end_time, label ]+ ]
-    s1 = round(interval[0] * 100)
-    e1 = round(interval[1] * 100)
-    for e in entryL:
-        s2 = round(e[0] * 100)
-        e2 = round(e[1] * 100)
-        if s1 >= s2 and e1 <= e2:
-            label = e[2]
-            ## debug(f'  isIntervalContained YES {s1} {e1} in {s2} {e2}')
-            return True, label
-        else:
-            ## debug(f'  isIntervalContained NO {s1} {e1} in {s2} {e2}')
-            pass
-    return False, None
-                
-    
+def paintEntries(labelArray, entries, offset):
+    # entries = ( $START_FRAMES, $END_FRAMES, $LABELS )
+    # set the label of the frames covered by each entry; the entries are
+    # painted in reverse order, so that where entries overlap the frame
+    # gets the label of the first one (as in the input file)
+    for tsStart, tsEnd, label in zip(*[a[::-1].tolist() for a in entries]):
+        if tsEnd > tsStart:
+            labelArray[tsStart - offset:tsEnd - offset] = label
 
-def getContinousStreamFromEntries(entryDict, globalInfoDict):
-    csList = []
-    stepMs= 0.04
 
+def getStreamTable(globalInfoDict):
+    # side table of the label streams: one row for each video and speaker
+    # (in the globalInfoDict order) with the offset of its frames
+    # [minFrame, maxFrame) in the concatenated label arrays
+    #
+    # [ [ $VIDEO, $SPK, $OFFSET, $MIN_FRAME, $NUM_FRAMES ]+ ]
+    streamTable = []
+    offset = 0
     for videoId,d in globalInfoDict.items():
-        minTs = globalInfoDict[videoId]["minTs"]
-        maxTs = globalInfoDict[videoId]["maxTs"]
-        spkL  = globalInfoDict[videoId]["speakers"]
-        if not videoId in entryDict:
-            # add the 0 (silence) label to all the intervals
-            for spkId in spkL:
-                tsS = minTs
-                while tsS < maxTs:
-                    tsE = tsS + stepMs
-                    label = 0
-                    csList.append([videoId, spkId, tsS, tsE, label])
-                    tsS = tsE
-        else:
-            for spkId in spkL:
-                if not spkId in entryDict[videoId]:
-                    # add the 0 (silence) label to all the intervals
-                    tsS = minTs
-                    while tsS < maxTs:
-                        tsE = tsS + stepMs
-                        label = 0
-                        csList.append([videoId, spkId, tsS, tsE, label])
-                        tsS = tsE
-                else:
-                    entryL = entryDict[videoId][spkId]
-                    # add the 0 (silence) label only outside entry intervals
-                    tsS = minTs
-                    while tsS < maxTs:
-                        tsE = tsS + stepMs
-                        flag, label = isIntervalContained([tsS, tsE], entryL)
-                        if not flag:
-                            label = 0
-                        csList.append([videoId, spkId, tsS, tsE, label])
-                        tsS = tsE
-    return csList
-
-
-def getHardLabel(x):
-    if x>=0.5:
-        return 1
-    else:
+        minFrame = d["minFrame"]
+        numFrames = d["maxFrame"] - minFrame
+        for spkId in d["speakers"]:
+            streamTable.append([videoId, spkId, offset, minFrame, numFrames])
+            offset += numFrames
+    return streamTable
+
+
+def getStreamLength(streamTable):
+    if not streamTable:
         return 0
+    return streamTable[-1][2] + streamTable[-1][4]
+
+
+def getLabelStreamFromEntries(entryDict, streamTable, dtype):
+    # the labels of all the streams of streamTable in a single array; the
+    # frames not covered by any entry get the 0 (silence) label
+    labelArray = np.zeros(getStreamLength(streamTable), dtype=dtype)
+    for videoId, spkId, offset, minFrame, numFrames in streamTable:
+        if videoId in entryDict and spkId in entryDict[videoId]:
+            paintEntries(labelArray[offset:offset + numFrames], entryDict[videoId][spkId], minFrame)
+    return labelArray
+
+
+def getReferenceBoundaries(bounds, values):
+    # the frames where the reference speech (label 1) starts or ends, from
+    # the runs (bounds, values) of a stream
+    speech = np.r_[False, values == 1, False]
+    return bounds[np.flatnonzero(speech[1:] != speech[:-1])]
 
 
+def isInCollar(frames, boundaries, collar):
+    # True for the frames within the collar of a (sorted) reference boundary
+    # b, i.e. in [b - collar, b + collar), with two binary searches per frame
+    return (np.searchsorted(boundaries, frames + collar, side='right') >
+            np.searchsorted(boundaries, frames - collar, side='right'))
+
+
+def getCollarMask(y_ref, streamTable, collar):
+    # the frames of the label arrays to score, i.e. not in the collar of a
+    # reference boundary of their stream
+    mask = np.ones(len(y_ref), dtype=bool)
+    for videoId, spkId, offset, minFrame, numFrames in streamTable:
+        r = y_ref[offset:offset + numFrames]
+        boundaries = getReferenceBoundaries(np.arange(numFrames + 1), r)
+        mask[offset:offset + numFrames] = ~isInCollar(np.arange(numFrames), boundaries, collar)
+    return mask
+
+
+def getScoreHistogram(y_ref, y_hyp):
+    # sort the hypothesis scores once: return the distinct scores in
+    # decreasing order and, for each of them, the number of positive and of
+    # negative reference frames having that score
+    scores, inverse = np.unique(y_hyp, return_inverse=True)
+    total = np.bincount(inverse, minlength=len(scores))
+    pos = np.bincount(inverse[y_ref == 1], minlength=len(scores))
+    return scores[::-1], pos[::-1], (total - pos)[::-1]
+
+
+def mergeScoreHistograms(histList):
+    # merge the histograms of different chunks (e.g. videos) of frames
+    if not histList:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if len(histList) == 1:
+        return histList[0]
+    scores, inverse = np.unique(np.concatenate([h[0] for h in histList]), return_inverse=True)
+    pos = np.zeros(len(scores), dtype=np.int64)
+    neg = np.zeros(len(scores), dtype=np.int64)
+    np.add.at(pos, inverse, np.concatenate([h[1] for h in histList]))
+    np.add.at(neg, inverse, np.concatenate([h[2] for h in histList]))
+    return scores[::-1], pos[::-1], neg[::-1]
+
+
+def getScoresFromHistogram(hist, threshold=0.5):
+    # average precision (as sklearn average_precision_score) and the
+    # precision, recall and F1 of the hard labels (score >= threshold),
+    # from a single cumulative sum over the sorted distinct scores
+    scores, pos, neg = hist
+    tps = np.cumsum(pos)
+    fps = np.cumsum(neg)
+    numPos = int(tps[-1]) if len(tps) else 0
+    if numPos > 0:
+        precisionCurve = tps / (tps + fps)
+        recallCurve = tps / numPos
+        # same summation order of sklearn: by increasing thresholds, with
+        # the (recall 0, precision 1) end point
+        map = float(-np.sum(np.diff(np.r_[recallCurve[::-1], 0]) * precisionCurve[::-1]))
+    else:
+        map = 0.0
+    # the number of distinct scores >= threshold
+    k = int(np.count_nonzero(scores >= threshold))
+    scores = {"mAP": map}
+    scores.update(getHardScores(tps, fps, numPos, k))
+    return scores
+
+
+def getHardScores(tps, fps, numPos, k):
+    # precision, recall and F1 of the hard labels given by the k highest
+    # distinct scores (tps, fps: cumulative sums of the score histogram)
+    tp = int(tps[k - 1]) if k > 0 else 0
+    fp = int(fps[k - 1]) if k > 0 else 0
+    fn = numPos - tp
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    recall    = tp / numPos if numPos > 0 else 0.0
+    f1        = 2 * tp / (2 * tp + fp + fn) if (2 * tp + fp + fn) > 0 else 0.0
+    return {"f1":  f1,
+            "precision": precision,
+            "recall": recall}
+
+
+def getThresholdSweep(hist, thresholdList):
+    # precision, recall and F1 at each threshold of thresholdList and at the
+    # best F1 threshold (any distinct hypothesis score), from a single
+    # cumulative sum over the score histogram
+    #
+    # { "curve": [ { "threshold": $T, "precision": .., "recall": .., "f1": .. }+ ],
+    #   "best_f1": { "threshold": $T, "precision": .., "recall": .., "f1": .. } }
+    scores, pos, neg = hist
+    tps = np.cumsum(pos)
+    fps = np.cumsum(neg)
+    numPos = int(tps[-1]) if len(tps) else 0
+    # the number of distinct scores >= each threshold (compared, as in
+    # getScoresFromHistogram, in the dtype of the scores)
+    kList = np.searchsorted(-scores, -np.asarray(thresholdList, dtype=scores.dtype), side='right').tolist()
+    curve = []
+    for threshold, k in zip(thresholdList, kList):
+        d = {"threshold": threshold}
+        d.update(getHardScores(tps, fps, numPos, k))
+        curve.append(d)
+    # F1 = 2tp / (2tp + fp + fn) = 2tp / (tp + fp + numPos) for every
+    # threshold (the first, i.e. highest, one wins the ties)
+    bestF1 = {"threshold": None}
+    if numPos > 0:
+        k = int(np.argmax(2 * tps / (tps + fps + numPos))) + 1
+        bestF1 = {"threshold": float(str(scores[k - 1]))}
+    bestF1.update(getHardScores(tps, fps, numPos, k if numPos > 0 else 0))
+    return {"curve": curve, "best_f1": bestF1}
+
+
+def getRunsFromEntries(entries, minFrame, maxFrame, dtype):
+    # entries = ( $START_FRAMES, $END_FRAMES, $LABELS )
+    # the label stream of [minFrame, maxFrame) as a step function: the
+    # sorted boundaries b0=minFrame < b1 < .. < bn=maxFrame and the label of
+    # each run [b(i), b(i+1)); as in paintEntries, where entries overlap the
+    # first one wins and the frames not covered by any entry get the 0 label
+    tsStart, tsEnd, labels = entries
+    boundList = np.unique(np.r_[minFrame, maxFrame, tsStart, tsEnd]).tolist()
+    startOrder = np.argsort(tsStart, kind='stable').tolist()
+    startL, endL, labelL = tsStart.tolist(), tsEnd.tolist(), labels.tolist()
+    valueList = []
+    heap = []
+    k = 0
+    for b in boundList[:-1]:
+        # the entries covering [b, next boundary): a heap by position in the file
+        while k < len(startOrder) and startL[startOrder[k]] <= b:
+            heapq.heappush(heap, (startOrder[k], endL[startOrder[k]]))
+            k += 1
+        while heap and heap[0][1] <= b:
+            heapq.heappop(heap)
+        valueList.append(labelL[heap[0][0]] if heap else 0)
+    return np.array(boundList, dtype=np.int64), np.array(valueList, dtype=dtype)
+
+
+def getIntervalScoreHistogram(hypRuns, refRuns, collar=0):
+    # the score histogram (as getScoreHistogram) of a stream from the runs
+    # of its hypothesis and reference, weighting each run by its length
+    # instead of expanding it to frames
+    hypBounds, hypValues = hypRuns
+    refBounds, refValues = refRuns
+    bounds = np.union1d(hypBounds, refBounds)
+    if collar > 0:
+        # split the runs at the collar edges, so that each run is either
+        # fully inside or fully outside the collars
+        boundaries = getReferenceBoundaries(refBounds, refValues)
+        edges = np.clip(np.r_[boundaries - collar, boundaries + collar], bounds[0], bounds[-1])
+        bounds = np.union1d(bounds, edges)
+    duration = np.diff(bounds)
+    if collar > 0:
+        duration = duration * ~isInCollar(bounds[:-1], boundaries, collar)
+    h = hypValues[np.searchsorted(hypBounds, bounds[:-1], side='right') - 1]
+    r = refValues[np.searchsorted(refBounds, bounds[:-1], side='right') - 1]
+    # the runs in the collars have no frames: their scores, as the masked
+    # frames of the frame engine, must not enter the histogram
+    keep = duration > 0
+    h, r, duration = h[keep], r[keep], duration[keep]
+    scores, inverse = np.unique(h, return_inverse=True)
+    total = np.bincount(inverse, weights=duration, minlength=len(scores)).astype(np.int64)
+    pos = np.bincount(inverse, weights=duration * (r == 1), minlength=len(scores)).astype(np.int64)
+    return scores[::-1], pos[::-1], (total - pos)[::-1]
+
+
+def getStreamHistogramsFromIntervals(hypDict, refDict, streamTable, collar=0):
+    # interval engine: [ [ $VIDEO, $SPK, $HISTOGRAM ]+ ] with the score
+    # histogram of each stream of streamTable, in O(n log n) in the number
+    # of entries of the stream
+    streamHistList = []
+    for videoId, spkId, offset, minFrame, numFrames in streamTable:
+        maxFrame = minFrame + numFrames
+        hypL = hypDict.get(videoId, {}).get(spkId, NoEntries)
+        refL = refDict.get(videoId, {}).get(spkId, NoEntries)
+        hist = getIntervalScoreHistogram(getRunsFromEntries(hypL, minFrame, maxFrame, np.float32),
+                                         getRunsFromEntries(refL, minFrame, maxFrame, np.int8), collar)
+        streamHistList.append([videoId, spkId, hist])
+    return streamHistList
+
+
+def getStreamHistograms(y_ref, y_hyp, streamTable, mask=None):
+    # frame engine: [ [ $VIDEO, $SPK, $HISTOGRAM ]+ ] with the score
+    # histogram of each stream, from the slices of the label arrays given by
+    # streamTable (only the frames in mask); their merge is the histogram of
+    # all the frames
+    streamHistList = []
+    for videoId, spkId, offset, minFrame, numFrames in streamTable:
+        r = y_ref[offset:offset + numFrames]
+        h = y_hyp[offset:offset + numFrames]
+        if mask is not None:
+            m = mask[offset:offset + numFrames]
+            r, h = r[m], h[m]
+        hist = getScoreHistogram(r, h)
+        streamHistList.append([videoId, spkId, hist])
+    return streamHistList
+
+
+def getBreakdownFromHistograms(streamHistList):
+    # streamHistList = [ [ $VIDEO, $SPK, $HISTOGRAM ]+ ]
+    #
+    # { $VIDEO : { "scores": $SCORES, "frames": $NUM_FRAMES, "speech_frames": $NUM_REF_SPEECH_FRAMES,
+    #              "speakers": { $SPK: { "scores": .., "frames": .., "speech_frames": .. } }
+    #            }
+    # }
+    # (ill-defined scores, e.g. of a speaker that never speaks, are set to 0)
+    breakdown = {}
+    videoHist = {}
+    for videoId, spkId, hist in streamHistList:
+        numFrames = int(np.sum(hist[1]) + np.sum(hist[2]))
+        if numFrames == 0:
+            continue
+        videoHist.setdefault(videoId, []).append(hist)
+        breakdown.setdefault(videoId, {"speakers": {}})["speakers"][spkId] = {
+            "scores": getScoresFromHistogram(hist),
+            "frames": numFrames,
+            "speech_frames": int(np.sum(hist[1]))}
+    for videoId, histList in videoHist.items():
+        # the video scores from the merged histograms of its speakers
+        hist = mergeScoreHistograms(histList)
+        spkD = breakdown[videoId].pop("speakers")
+        breakdown[videoId] = {"scores": getScoresFromHistogram(hist),
+                              "frames": int(np.sum(hist[1]) + np.sum(hist[2])),
+                              "speech_frames": int(np.sum(hist[1])),
+                              "speakers": spkD}
+    return breakdown
+
+
+def getVideoScoreHistogram(task):
+    # build (in a worker process) the label arrays of a single video and
+    # return their score histogram and optionally the breakdown of the video
+    videoId, videoInfo, hypEntryDict, refEntryDict, doBreakdown, collar = task
+    streamTable = getStreamTable({videoId: videoInfo})
+    y_hyp = getLabelStreamFromEntries(hypEntryDict, streamTable, np.float32)
+    y_ref = getLabelStreamFromEntries(refEntryDict, streamTable, np.int8)
+    mask = None
+    if collar > 0:
+        mask = getCollarMask(y_ref, streamTable, collar)
+    if doBreakdown:
+        # the video histogram from those of its speakers, sorted once
+        streamHistList = getStreamHistograms(y_ref, y_hyp, streamTable, mask)
+        return (mergeScoreHistograms([h for _, _, h in streamHistList]),
+                getBreakdownFromHistograms(streamHistList))
+    if mask is not None:
+        y_ref, y_hyp = y_ref[mask], y_hyp[mask]
+    return getScoreHistogram(y_ref, y_hyp), None
+
+
+def getScoreHistogramInParallel(hypDict, refDict, globalInfoDict, numJobs, doBreakdown, collar=0, chunkSize=64):
+    # build the label arrays video by video in a pool of processes; only the
+    # (sorted) score histograms of the videos go back to the main process,
+    # where they are merged every chunkSize videos
+    histList = []
+    breakdown = {}
+    taskList = ((videoId, d, {videoId: hypDict[videoId]} if videoId in hypDict else {},
+                 {videoId: refDict[videoId]} if videoId in refDict else {}, doBreakdown, collar)
+                for videoId, d in globalInfoDict.items())
+    with ProcessPoolExecutor(max_workers=numJobs) as pool:
+        for vHist, vBreakdown in pool.map(getVideoScoreHistogram, taskList, chunksize=4):
+            histList.append(vHist)
+            if len(histList) >= chunkSize:
+                histList = [mergeScoreHistograms(histList)]
+            if vBreakdown:
+                breakdown.update(vBreakdown)
+    return mergeScoreHistograms(histList), breakdown
+
 
 DebugFlag = False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes building the label streams (default 1)")
+    parser.add_argument("-e", "--engine", choices=["frames", "intervals"], default="frames",
+                        help="score the label streams expanded to 25 FPS frames (default) or "
+                             "directly from the intervals of the entries (same scores, faster "
+                             "on long videos; -j is ignored)")
+    parser.add_argument("-c", "--collar", type=float, default=0.0,
+                        help="do not score the frames within this many seconds of the start or "
+                             "end of a reference speech segment (default 0, e.g. 0.25)")
+    parser.add_argument("-t", "--thresholds", type=lambda x: [float(t) for t in x.split(",")],
+                        help="comma separated list of thresholds (e.g. 0.3,0.5,0.7): also report "
+                             "precision, recall and F1 at each of them and the best F1 threshold "
+                             "(in the threshold_sweep field)")
+    parser.add_argument("-b", "--breakdown-file",
+                        help="write the scores of each video and speaker in this json file")
     parser.add_argument("hypTSVFile")
     parser.add_argument("refTSVFile")
     args = parser.parse_args()
@@ -251,46 +533,57 @@ if __name__ == "__main__":
     globalInfoDict = getGlobalInfoDict(hypInfoDict, refInfoDict)
     debug(f'globalInfoDict {globalInfoDict}')
 
-    hypCS = getContinousStreamFromEntries(hypDict, globalInfoDict)
-    debug(f'hypCS {len(hypCS)}')
-    ## for e in hypCS:
-    ##    debug(f'  {e[0]} {e[1]} {e[2]:.2f} {e[3]:.2f} {e[4]}')
-
-    refCS = getContinousStreamFromEntries(refDict, globalInfoDict)
-    debug(f'refCS {len(refCS)}')
-    ## for e in refCS:
-    ##    debug(f'  {e[0]} {e[1]} {e[2]:.2f} {e[3]:.2f} {e[4]}')
-
-    hypLabelList = [x[4] for x in hypCS]
-    hypHardLabelList = [getHardLabel(x) for x in hypLabelList]
-    refLabelList = [x[4] for x in refCS]
-    debug(f'hypLabelList {hypLabelList}')
-    debug(f'hypHardLabelList {hypHardLabelList}')
-    debug(f'refLabelList {refLabelList}')
-    
-    y_hyp = np.array(hypLabelList)
-    y_hyp_hard = np.array(hypHardLabelList)
-    y_ref = np.array(refLabelList)
+    streamTable = getStreamTable(globalInfoDict)
+    debug(f'streamTable {len(streamTable)} streams')
+
+    # the collar as a number of 25 FPS frames
+    collar = int(round(args.collar * 25))
+
+    if args.engine == "intervals":
+        streamHistList = getStreamHistogramsFromIntervals(hypDict, refDict, streamTable, collar)
+        hist = mergeScoreHistograms([h for _, _, h in streamHistList])
+        breakdown = None
+        if args.breakdown_file:
+            breakdown = getBreakdownFromHistograms(streamHistList)
+    elif args.jobs > 1:
+        hist, breakdown = getScoreHistogramInParallel(hypDict, refDict, globalInfoDict,
+                                                      args.jobs, args.breakdown_file is not None, collar)
+    else:
+        # confidence scores (or 0|1 labels) of the hypothesis
+        y_hyp = getLabelStreamFromEntries(hypDict, streamTable, np.float32)
+        # 0|1 labels of the reference
+        y_ref = getLabelStreamFromEntries(refDict, streamTable, np.int8)
+        debug(f'hypCS {len(y_hyp)}')
+        debug(f'refCS {len(y_ref)}')
+        debug(f'hypLabelList {y_hyp}')
+        debug(f'refLabelList {y_ref}')
+        mask = None
+        if collar > 0:
+            mask = getCollarMask(y_ref, streamTable, collar)
+            debug(f'{np.count_nonzero(~mask)} frames in the collars')
+        breakdown = None
+        if args.breakdown_file:
+            # the global histogram from the stream ones, sorted once
+            streamHistList = getStreamHistograms(y_ref, y_hyp, streamTable, mask)
+            hist = mergeScoreHistograms([h for _, _, h in streamHistList])
+            breakdown = getBreakdownFromHistograms(streamHistList)
+        else:
+            if mask is not None:
+                y_ref, y_hyp = y_ref[mask], y_hyp[mask]
+            hist = getScoreHistogram(y_ref, y_hyp)
+    debug(f'{len(hist[0])} distinct hypothesis scores')
 
     # Compute the global mAP score
-    map       = average_precision_score(y_ref, y_hyp)
-    precision = precision_score(y_ref, y_hyp_hard)
-    recall    = recall_score(y_ref, y_hyp_hard)
-    f1        = f1_score(y_ref, y_hyp_hard)
-
-    '''
-    scores = {"mAP": f'{map:.4f}',
-              "f1":  f'{f1:.4f}',
-              "precision": f'{precision:.4f}',
-              "recall": f'{recall:.4f}'}
-    '''
-
-    scores = {"mAP": map,
-              "f1":  f1,
-              "precision": precision,
-              "recall": recall}
-
-    print(json.dumps({
+    scores = getScoresFromHistogram(hist)
+
+    if args.breakdown_file:
+        with open(args.breakdown_file, "w") as fp:
+            json.dump(breakdown, fp, indent=2)
+
+    result = {
         "state": "OK",
         "scores": scores
-    }))
+    }
+    if args.thresholds:
+        result["threshold_sweep"] = getThresholdSweep(hist, args.thresholds)
+    print(json.dumps(result))
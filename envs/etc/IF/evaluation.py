@@ -17,15 +17,20 @@ import os
 import re
 import shutil
 import subprocess
+import sys
 import tempfile
 import xml.etree.ElementTree as ET
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, List
 
+# the model registry must be imported before bert_score and comet
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import model_registry
+
 import bert_score
 import jiwer
-from comet import download_model, load_from_checkpoint
+from comet import load_from_checkpoint
 from whisper_normalizer import english, basic
 
 
@@ -192,7 +197,7 @@ def bertscore(
         hypos.append(hypo_dict[ref_sample.sample_ids[0]])
         refs.append(ref_sample.reference)
 
-    P, R, F1 = bert_score.score(hypos, refs, lang=lang, rescale_with_baseline=True)
+    P, R, F1 = bert_score.score(hypos, refs, **model_registry.getBertscoreArgs(lang))
     return F1.mean().detach().item()
 
 
@@ -201,7 +206,7 @@ def comet_score(data: List[Dict[str, str]]) -> float:
     Computes COMET starting from a List of Dictionary, each containing the "mt", "src", and "ref"
     keys.
     """
-    model_path = download_model("Unbabel/wmt22-comet-da")
+    model_path = model_registry.getCometCheckpoint("Unbabel/wmt22-comet-da")
     model = load_from_checkpoint(model_path)
     model.eval()
     model_output = model.predict(data, batch_size=8, gpus=1)
@@ -44,8 +44,7 @@ Authors:
 import re
 from typing import Dict, List, Tuple, Union
 import editdistance as ed
-from scipy.interpolate import interp1d
-from scipy.optimize import brentq
+import numpy as np
 from sklearn.metrics import roc_curve
 
 
@@ -140,8 +139,30 @@ def compute_eer(labels: List[int], scores: List[float]):
         treshold (float): The treshold to accept a target trial.
     """
     fpr, tpr, thresholds = roc_curve(labels, scores, pos_label=1)
-    eer = brentq(lambda x: 1.0 - x - interp1d(fpr, tpr)(x), 0.0, 1.0)
-    threshold = interp1d(fpr, thresholds)(eer)
+    fnr = 1.0 - tpr
+    # the first ROC point where the miss rate is not above the false alarm
+    # rate (the first point, fpr = 0 and fnr = 1, never is): the EER is where
+    # the (linearly interpolated) ROC segment ending there crosses fnr == fpr
+    i = max(int(np.argmax(fnr <= fpr)), 1)
+    g0 = fnr[i - 1] - fpr[i - 1]
+    g1 = fnr[i] - fpr[i]
+    t = g0 / (g0 - g1) if g0 > g1 else 1.0
+    # (exactly the fpr of the end point when the segment ends on the crossing)
+    eer = float(fpr[i]) if t >= 1.0 else float(fpr[i - 1] + t * (fpr[i] - fpr[i - 1]))
+    # the threshold at fpr == eer, interpolated as interp1d(fpr, thresholds);
+    # when eer is the fpr of ROC points (a vertical segment, e.g. eer = 0)
+    # the threshold of the last of them, the lowest one; no interpolation
+    # on the first segment either, whose start threshold is inf
+    j = int(np.searchsorted(fpr, eer, side="right")) - 1
+    if j >= 0 and fpr[j] == eer:
+        threshold = float(thresholds[max(j, 1)])
+    else:
+        j = min(max(j + 1, 1), len(fpr) - 1)
+        if not np.isfinite(thresholds[j - 1]):
+            threshold = float(thresholds[j])
+        else:
+            slope = (thresholds[j] - thresholds[j - 1]) / (fpr[j] - fpr[j - 1])
+            threshold = float(slope * (eer - fpr[j - 1]) + thresholds[j - 1])
     return eer, threshold
 
 
@@ -169,16 +190,12 @@ def compute_minDCF(
     fpr, tpr, thresholds = roc_curve(labels, scores, pos_label=1)
     fnr = 1.0 - tpr
 
-    min_c_det = float("inf")
-    min_c_det_threshold = thresholds[0]
-    for i in range(0, len(fnr)):
-        c_det = c_miss * fnr[i] * p_target + c_fa * fpr[i] * (1 - p_target)
-        if c_det < min_c_det:
-            min_c_det = c_det
-            min_c_det_threshold = thresholds[i]
+    # the detection cost at every ROC threshold (the first minimum wins)
+    c_det = c_miss * fnr * p_target + c_fa * fpr * (1 - p_target)
+    i = int(np.argmin(c_det))
     c_def = min(c_miss * p_target, c_fa * (1 - p_target))
-    min_dcf = min_c_det / c_def
-    return min_dcf, min_c_det_threshold
+    min_dcf = float(c_det[i] / c_def)
+    return min_dcf, float(thresholds[i])
 
 
 def clean(ref: str) -> str:
@@ -228,11 +245,100 @@ def get_slot_dict(
     return ref_dict, hyp_dict
 
 
+def get_interned_slot_dict(slots, transcript, slot_ids) -> Dict[int, List[str]]:
+    """Parses the slots of an utterance.
+
+    Args:
+        slots (str): The slot tags of the utterance.
+        transcript (str): The transcript of the utterance.
+        slot_ids (Dict[str, int]): The ids of the slot types (shared by
+            hypotheses and references), filled while parsing.
+
+    Returns:
+        Dict[int, List[str]]: The tokens of each slot type (as in
+        get_slot_dict, with the slot type ids as keys).
+    """
+    slot_dict = {}
+    for slot_tok, transcript_tok in zip(slots.split(), transcript.split()):
+        if slot_tok in slot_dict:
+            slot_dict[slot_tok].append(transcript_tok)
+        else:
+            slot_dict[slot_tok] = [transcript_tok]
+    return {slot_ids.setdefault(slot, len(slot_ids)): values for slot, values in slot_dict.items()}
+
+
+def utterance_slot_type_f1(hyp_dict, ref_dict) -> float:
+    if len(hyp_dict) == 0 and len(ref_dict) == 0:
+        return 1.0
+    elif len(hyp_dict) == 0 or len(ref_dict) == 0:
+        return 0.0
+    common = float(len(hyp_dict.keys() & ref_dict.keys()))
+    R = common / len(ref_dict)
+    P = common / len(hyp_dict)
+    return 2 * P * R / (P + R) if (P + R) > 0 else 0.0
+
+
+def utterance_slot_value_errors(hyp_dict, ref_dict) -> Tuple[int, int]:
+    # all the (hyp value, ref value) pairs of the utterance with the same
+    # slot type, scored with a single batch of edit distances
+    pair_hyps, pair_refs = [], []
+    for slot, ref_values in ref_dict.items():
+        hyp_values = hyp_dict.get(slot, ())
+        for ref_v in ref_values:
+            pair_hyps.extend(hyp_values)
+            pair_refs.extend([ref_v] * len(hyp_values))
+    dist_list = list(map(ed.eval, pair_hyps, pair_refs))
+
+    # Slot Value CER evaluation: for each ref value the hyp value of the same
+    # slot with the lowest CER, i.e. the lowest distance (the empty string if
+    # the slot is missing or no CER is below 100)
+    error_chars, total_chars = 0, 0
+    k = 0
+    for slot, ref_values in ref_dict.items():
+        num_hyps = len(hyp_dict.get(slot, ()))
+        for ref_v in ref_values:
+            best_dist = len(ref_v)
+            if num_hyps > 0:
+                min_dist = min(dist_list[k:k + num_hyps])
+                if min_dist < 100 * len(ref_v):
+                    best_dist = min_dist
+                k += num_hyps
+            error_chars += best_dist
+            total_chars += len(ref_v)
+    return error_chars, total_chars
+
+
+def slot_type_f1_and_value_cer(
+        slots_pred_list,
+        transcript_pred_list,
+        slots_label_list,
+        transcript_label_list) -> Tuple[float, float]:
+    """Computes slot_type_f1 and slot_value_cer parsing each utterance once."""
+    slot_ids = {}
+    F1s = []
+    error_chars, total_chars = 0, 0
+
+    for p_slot, p_trans, t_slot, t_trans in zip(
+            slots_pred_list,
+            transcript_pred_list,
+            slots_label_list,
+            transcript_label_list):
+        hyp_dict = get_interned_slot_dict(p_slot, p_trans, slot_ids)
+        ref_dict = get_interned_slot_dict(t_slot, t_trans, slot_ids)
+        F1s.append(utterance_slot_type_f1(hyp_dict, ref_dict))
+        errors, chars = utterance_slot_value_errors(hyp_dict, ref_dict)
+        error_chars += errors
+        total_chars += chars
+
+    return sum(F1s) / len(F1s), float(error_chars) / float(total_chars)
+
+
 def slot_type_f1(
         slots_pred_list,
         transcript_pred_list,
         slots_label_list,
         transcript_label_list) -> float:
+    slot_ids = {}
     F1s = []
 
     for p_slot, p_trans, t_slot, t_trans in zip(
@@ -240,26 +346,9 @@ def slot_type_f1(
             transcript_pred_list,
             slots_label_list,
             transcript_label_list):
-        ref_dict, hyp_dict = get_slot_dict(p_slot, p_trans, t_slot, t_trans)
-
-        if len(hyp_dict.keys()) == 0 and len(ref_dict.keys()) == 0:
-            F1 = 1.0
-        elif len(hyp_dict.keys()) == 0:
-            F1 = 0.0
-        elif len(ref_dict.keys()) == 0:
-            F1 = 0.0
-        else:
-            P, R = 0.0, 0.0
-            for slot in ref_dict:
-                if slot in hyp_dict:
-                    R += 1
-            R = R / len(ref_dict.keys())
-            for slot in hyp_dict:
-                if slot in ref_dict:
-                    P += 1
-            P = P / len(hyp_dict.keys())
-            F1 = 2 * P * R / (P + R) if (P + R) > 0 else 0.0
-        F1s.append(F1)
+        F1s.append(utterance_slot_type_f1(
+            get_interned_slot_dict(p_slot, p_trans, slot_ids),
+            get_interned_slot_dict(t_slot, t_trans, slot_ids)))
 
     return sum(F1s) / len(F1s)
 
@@ -269,35 +358,21 @@ def slot_value_cer(
         transcript_pred_list,
         slots_label_list,
         transcript_label_list) -> float:
-    value_hyps, value_refs = [], []
+    slot_ids = {}
+    error_chars, total_chars = 0, 0
 
     for p_slot, p_trans, t_slot, t_trans in zip(
             slots_pred_list,
             transcript_pred_list,
             slots_label_list,
             transcript_label_list):
-        ref_dict, hyp_dict = get_slot_dict(p_slot, p_trans, t_slot, t_trans)
+        errors, chars = utterance_slot_value_errors(
+            get_interned_slot_dict(p_slot, p_trans, slot_ids),
+            get_interned_slot_dict(t_slot, t_trans, slot_ids))
+        error_chars += errors
+        total_chars += chars
 
-        # Slot Value WER/CER evaluation
-        unique_slots = list(ref_dict.keys())
-        for slot in unique_slots:
-            for ref_i, ref_v in enumerate(ref_dict[slot]):
-                if slot not in hyp_dict:
-                    hyp_v = ""
-                    value_refs.append(ref_v)
-                    value_hyps.append(hyp_v)
-                else:
-                    min_cer = 100
-                    best_hyp_v = ""
-                    for hyp_v in hyp_dict[slot]:
-                        tmp_cer = cer([hyp_v], [ref_v])
-                        if min_cer > tmp_cer:
-                            min_cer = tmp_cer
-                            best_hyp_v = hyp_v
-                    value_refs.append(ref_v)
-                    value_hyps.append(best_hyp_v)
-
-    return cer(value_hyps, value_refs)
+    return float(error_chars) / float(total_chars)
 
 
 def slot_value_wer(hypothesis: List[str], groundtruth: List[str], **kwargs) -> float:
@@ -415,8 +490,6 @@ https://github.com/alexa/massive/blob/main/src/massive/utils/training_utils.py
 """
 
 from math import sqrt
-from seqeval.metrics import f1_score
-import sklearn.metrics as sklm
 
 
 class MassiveEval:
@@ -481,6 +554,82 @@ class MassiveEval:
 
         return bio_tagged
 
+    def convert_slots_to_ids(self, lab_slots, pred_slots, pad="Other"):
+        """
+        Maps the slot labels of all the sequences to integer ids, padding or
+        truncating each prediction to the length of its label sequence (as in
+        eval_preds) and concatenating the sequences
+
+        :return: the tag ids of the labels and of the predictions (int32
+                 arrays of the same length), the start offset of each sequence
+                 and the list of the tags (as strings, indexed by id)
+        :rtype: tuple
+        """
+        tag_ids = {}
+        lab_ids, pred_ids, lengths = [], [], []
+        for lab, pred in zip(lab_slots, pred_slots):
+
+            # Pad or truncate prediction as needed using `pad` arg
+            if type(pred) is list:
+                pred = pred[: len(lab)] + [pad] * (len(lab) - len(pred))
+
+            # Fix for Issue 21 -- subwords after the first one from a word should be ignored
+            if -100 in lab:
+                pred = [-100 if x == -100 else p for x, p in zip(lab, pred)]
+
+            lab_ids.extend([tag_ids.setdefault(str(x), len(tag_ids)) for x in lab])
+            pred_ids.extend([tag_ids.setdefault(str(x), len(tag_ids)) for x in pred])
+            lengths.append(len(lab))
+
+        sent_starts = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=sent_starts[1:])
+        return (np.array(lab_ids, dtype=np.int32), np.array(pred_ids, dtype=np.int32),
+                sent_starts, list(tag_ids))
+
+    def convert_ids_to_bio(self, tag_ids, sent_starts, is_outside, is_merge):
+        """
+        Array version of convert_to_bio for a batch of concatenated sequences
+        of tag ids: the merge labels take the last non-merge label of their
+        sequence (O at the start of a sequence), the outside labels are O and
+        the others are B when they differ from the previous label, I otherwise
+
+        :param tag_ids: the tag ids of the concatenated sequences
+        :type tag_ids: np.ndarray
+        :param sent_starts: the start offset of each sequence
+        :type sent_starts: np.ndarray
+        :param is_outside: for each tag id, whether it is an outside label
+        :type is_outside: np.ndarray
+        :param is_merge: for each tag id, whether it is a label to merge leftward
+        :type is_merge: np.ndarray
+        :return: the BIO code of each token (0 = O, 1 = B, 2 = I) and its slot
+                 type (the tag id, -1 for O)
+        :rtype: tuple
+        """
+        n = len(tag_ids)
+        pos = np.arange(n)
+        # an outside label is never merged (it resets the previous label)
+        merge = is_merge[tag_ids] & ~is_outside[tag_ids]
+        sent_first = np.repeat(sent_starts, np.diff(np.r_[sent_starts, n]))
+        last = np.maximum.accumulate(np.where(merge, -1, pos)) if n else pos
+        label = np.where(last >= sent_first, tag_ids[np.maximum(last, 0)], -1)
+        prev_label = np.roll(label, 1)
+        prev_label[sent_starts[sent_starts < n]] = -1
+        outside = (label < 0) | is_outside[np.maximum(label, 0)]
+        bio = np.where(outside, 0, np.where(~merge & (label != prev_label), 1, 2)).astype(np.int8)
+        return bio, np.where(outside, -1, label)
+
+    def get_spans(self, bio, slot_types):
+        """
+        The slots (as seqeval entities) of BIO-coded sequences
+
+        :return: the start, the end (excluded) and the slot type of each slot
+        :rtype: tuple
+        """
+        starts = np.flatnonzero(bio == 1)
+        not_inside = np.r_[np.flatnonzero(bio != 2), len(bio)]
+        ends = not_inside[np.searchsorted(not_inside, starts, side="right")]
+        return starts, ends, slot_types[starts]
+
     def eval_preds(
             self,
             pred_intents=None,
@@ -526,52 +675,60 @@ class MassiveEval:
             assert len(pred_slots) == len(lab_slots), \
                 "pred_slots and lab_slots must be same length"
 
+        if pred_intents is not None and lab_intents is not None:
+            # intents as ids
+            intent_ids = {}
+            pred_intent_ids = np.array([intent_ids.setdefault(x, len(intent_ids)) for x in pred_intents])
+            lab_intent_ids = np.array([intent_ids.setdefault(x, len(intent_ids)) for x in lab_intents])
+
         if ("intent_acc" in eval_metrics) or ("all" in eval_metrics):
-            intent_acc = sklm.accuracy_score(lab_intents, pred_intents)
+            intent_acc = float(np.count_nonzero(pred_intent_ids == lab_intent_ids)) / len(lab_intent_ids)
             results["intent_acc"] = intent_acc
             # Assuming normal distribution. Multiply by z (from "z table") to get confidence int
             results["intent_acc_stderr"] = sqrt(intent_acc * (1 - intent_acc) / len(pred_intents))
 
-        if lab_slots is not None and pred_slots is not None:
-            bio_slot_labels, bio_slot_preds = [], []
-            for lab, pred in zip(lab_slots, pred_slots):
-
-                # Pad or truncate prediction as needed using `pad` arg
-                if type(pred) is list:
-                    pred = pred[: len(lab)] + [pad] * (len(lab) - len(pred))
-
-                # Fix for Issue 21 -- subwords after the first one from a word should be ignored
-                for i, x in enumerate(lab):
-                    if x == -100:
-                        pred[i] = -100
-
-                # convert to BIO
-                bio_slot_labels.append(
-                    self.convert_to_bio(lab, outside=labels_ignore, labels_merge=labels_merge))
-                bio_slot_preds.append(
-                    self.convert_to_bio(pred, outside=labels_ignore, labels_merge=labels_merge))
+        if lab_slots is not None and pred_slots is not None and (
+                ("slot_micro_f1" in eval_metrics) or ("ex_match_acc" in eval_metrics)
+                or ("all" in eval_metrics)):
+            lab_ids, pred_ids, sent_starts, tag_list = self.convert_slots_to_ids(lab_slots, pred_slots, pad)
+
+            # convert to BIO
+            outside = labels_ignore if type(labels_ignore) is list else [labels_ignore]
+            outside = set(str(x) for x in outside)
+            merge = labels_merge if type(labels_merge) is list else [labels_merge]
+            merge = set(str(x) for x in merge) if labels_merge else set()
+            is_outside = np.array([tag in outside for tag in tag_list] + [False], dtype=bool)
+            is_merge = np.array([tag in merge for tag in tag_list] + [False], dtype=bool)
+            lab_bio, lab_types = self.convert_ids_to_bio(lab_ids, sent_starts, is_outside, is_merge)
+            pred_bio, pred_types = self.convert_ids_to_bio(pred_ids, sent_starts, is_outside, is_merge)
 
         if ("slot_micro_f1" in eval_metrics) or ("all" in eval_metrics):
 
-            # from seqeval
-            ## smf1 = f1_score(bio_slot_labels, bio_slot_preds)
-            smf1 = float(f1_score(bio_slot_labels, bio_slot_preds))
+            # span-level micro F1 (as seqeval f1_score): a predicted slot is
+            # correct if a label slot has the same start, end and type
+            lab_starts, lab_ends, lab_span_types = self.get_spans(lab_bio, lab_types)
+            pred_starts, pred_ends, pred_span_types = self.get_spans(pred_bio, pred_types)
+            _, lab_idx, pred_idx = np.intersect1d(
+                lab_starts, pred_starts, assume_unique=True, return_indices=True)
+            tp = int(np.count_nonzero((lab_ends[lab_idx] == pred_ends[pred_idx])
+                                      & (lab_span_types[lab_idx] == pred_span_types[pred_idx])))
+            precision = tp / len(pred_starts) if len(pred_starts) > 0 else 0.0
+            recall = tp / len(lab_starts) if len(lab_starts) > 0 else 0.0
+            smf1 = 2.0 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
             results["slot_micro_f1"] = smf1
             # Assuming normal distribution. Multiply by z (from "z table") to get confidence int
-            total_slots = sum([len(x) for x in bio_slot_preds])
+            total_slots = len(pred_bio)
             results["slot_micro_f1_stderr"] = sqrt(smf1 * (1 - smf1) / total_slots)
 
         if ("ex_match_acc" in eval_metrics) or ("all" in eval_metrics):
-            # calculate exact match accuracy (~0.01 seconds)
-            matches = 0
-            denom = 0
-            for p_int, p_slot, l_int, l_slot in zip(
-                    pred_intents, bio_slot_preds, lab_intents, bio_slot_labels):
-
-                if (p_int == l_int) and (p_slot == l_slot):
-                    matches += 1
-                denom += 1
-            emacc = matches / denom
+            # calculate exact match accuracy: same intent and same BIO slots
+            sent_idx = np.repeat(np.arange(len(sent_starts)), np.diff(np.r_[sent_starts, len(lab_bio)]))
+            mismatch = np.zeros(len(sent_starts), dtype=bool)
+            mismatch[sent_idx[(lab_bio != pred_bio) | (lab_types != pred_types)]] = True
+            num_sents = min(len(sent_starts), len(pred_intent_ids))
+            matches = int(np.count_nonzero(
+                (pred_intent_ids[:num_sents] == lab_intent_ids[:num_sents]) & ~mismatch[:num_sents]))
+            emacc = matches / num_sents
 
             results["ex_match_acc"] = emacc
             # Assuming normal distribution. Multiply by z (from "z table") to get confidence int
@@ -747,8 +904,10 @@ def _parse_prediction(target_format_content, separator, pred_list):
     return output
 
 
+import sys
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
 
 debugFlag = False
 
@@ -757,22 +916,12 @@ def debug(msg):
         print(f'{msg}', file=sys.stderr)
     
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--debug", action="store_true")
-    parser.add_argument("hypFile")
-    parser.add_argument("refFile")
-    args = parser.parse_args()
-
-    if args.debug:
-        global debugFlag
-        debugFlag = True
-    hypFile = args.hypFile
-    refFile = args.refFile
-
-    language = 'es_ES'
-    pred_file_reads  = open(hypFile, 'r').readlines()
-    label_file_reads = open(refFile, 'r').readlines()
+def evaluate_files(hypFile, refFile):
+    """Returns the SLU scores of a hyp file against a ref file."""
+    with open(hypFile, 'r') as f:
+        pred_file_reads = f.readlines()
+    with open(refFile, 'r') as f:
+        label_file_reads = f.readlines()
 
     pred_parse_result_list = _parse_prediction(
         'transcript_slots_intent',
@@ -791,13 +940,8 @@ def main():
     transcript_label_list = label_parse_result_list["transcript"]
     slots_label_list = label_parse_result_list["slots"]
 
-    superb_type_slot_type_f1_value = slot_type_f1(
-        slots_pred_list,
-        transcript_pred_list,
-        slots_label_list,
-        transcript_label_list)
-
-    superb_type_slot_value_cer_value = slot_value_cer(
+    # both SUPERB metrics from a single parse of each utterance
+    superb_type_slot_type_f1_value, superb_type_slot_value_cer_value = slot_type_f1_and_value_cer(
         slots_pred_list,
         transcript_pred_list,
         slots_label_list,
@@ -823,6 +967,73 @@ def main():
     eval_result["intent_accuracy_mean"] = ia_result["intent_acc"]
     eval_result["intent_accuracy_standard_error"] = ia_result["intent_acc_stderr"]
 
+    return eval_result
+
+
+def evaluate_locale(task):
+    # worker of the batch mode: the scores (or the error) of a locale
+    locale, hypFile, refFile = task
+    try:
+        return locale, evaluate_files(hypFile, refFile)
+    except Exception as e:
+        return locale, {"state": "ERROR", "reason": f'{type(e).__name__}: {e}'}
+
+
+def evaluate_batch(batchFile, numJobs):
+    """Scores the (locale, hyp file, ref file) triples of a tsv file in a pool
+    of processes.
+
+    Returns:
+        dict: the scores of each locale and their macro average
+        (the standard errors are not averaged; locales with errors are
+        left out of the average)
+    """
+    taskList = []
+    with open(batchFile, 'r') as f:
+        for line in f:
+            if line.strip():
+                locale, hypFile, refFile = line.rstrip('\n').split('\t')[:3]
+                taskList.append((locale, hypFile, refFile))
+    debug(f'{len(taskList)} locales with {numJobs} jobs')
+
+    with ProcessPoolExecutor(max_workers=numJobs) as pool:
+        localeResults = dict(pool.map(evaluate_locale, taskList))
+
+    okList = [r for r in localeResults.values() if r.get("state") != "ERROR"]
+    macroAverage = {}
+    if okList:
+        for metric in okList[0]:
+            if not metric.endswith("standard_error"):
+                macroAverage[metric] = sum(r[metric] for r in okList) / len(okList)
+    return {"macro_average": macroAverage,
+            "locales": localeResults,
+            "num_locales": len(localeResults),
+            "num_errors": len(localeResults) - len(okList)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("-b", "--batch-file",
+                        help="tsv file with lines: locale hypFile refFile; score all of them "
+                             "(instead of hypFile refFile) and print the per-locale scores "
+                             "and their macro average")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes of the batch mode (default 1)")
+    parser.add_argument("hypFile", nargs="?")
+    parser.add_argument("refFile", nargs="?")
+    args = parser.parse_args()
+
+    if args.debug:
+        global debugFlag
+        debugFlag = True
+
+    if args.batch_file:
+        eval_result = evaluate_batch(args.batch_file, args.jobs)
+    else:
+        if args.hypFile is None or args.refFile is None:
+            parser.error("hypFile and refFile are required without --batch-file")
+        eval_result = evaluate_files(args.hypFile, args.refFile)
 
     print(json.dumps(eval_result))
 
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+# EER and minDCF of a speaker (or audio-visual) verification system
+#
+# scoreFile:  one line for each trial:  <trial> <score>
+# keyFile:    one line for each trial:  <trial> <label>
+#
+# where <trial> is one or more fields (e.g. "enroll_id test_id") that must
+# be the same in the two files and <label> is 1|target|tgt|true for the
+# target trials and 0|nontarget|nontgt|imp|impostor|false for the others
+
+import sys
+import json
+import argparse
+import numpy as np
+
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(abspath(__file__)))
+from slu_eval import compute_eer, compute_minDCF
+
+
+TargetLabels = {"1", "target", "tgt", "true"}
+NonTargetLabels = {"0", "nontarget", "nontgt", "imp", "impostor", "false"}
+
+
+def debug(msg):
+    if DebugFlag:
+        print(f'{msg}', file=sys.stderr)
+
+
+def loadTrials(trialFile):
+    # { $TRIAL : $VALUE } with the last field of each line as value
+    trialDict = {}
+    numTrials = 0
+    with open(trialFile, "r") as f:
+        for n, line in enumerate(f, 1):
+            fieldList = line.split()
+            if not fieldList:
+                continue
+            if len(fieldList) < 2:
+                raise ValueError(f'{trialFile}: missing trial or value in line {n}')
+            trialDict[" ".join(fieldList[:-1])] = fieldList[-1]
+            numTrials += 1
+    if len(trialDict) < numTrials:
+        raise ValueError(f'{trialFile}: {numTrials - len(trialDict)} repeated trials')
+    return trialDict
+
+
+def getLabelsAndScores(scoreDict, keyDict):
+    # the labels (0|1) and the scores of the trials of the key, as arrays
+    missingList = [t for t in keyDict if t not in scoreDict]
+    if missingList:
+        raise ValueError(f'{len(missingList)} trials without score (e.g. {missingList[0]})')
+    labelDict = dict.fromkeys(TargetLabels, 1)
+    labelDict.update(dict.fromkeys(NonTargetLabels, 0))
+    try:
+        labels = np.array([labelDict[label.lower()] for label in keyDict.values()], dtype=np.int8)
+    except KeyError as e:
+        raise ValueError(f'unknown label {e}') from None
+    scores = np.array([scoreDict[t] for t in keyDict], dtype=np.float64)
+    return labels, scores
+
+
+def finiteOrNone(x):
+    # json has no infinity (the threshold above the highest score)
+    return x if np.isfinite(x) else None
+
+
+DebugFlag = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("-p", "--p-target", type=float, default=0.01,
+                        help="prior of the target trials of the minDCF (default 0.01)")
+    parser.add_argument("--c-miss", type=float, default=1,
+                        help="cost of a miss of the minDCF (default 1)")
+    parser.add_argument("--c-fa", type=float, default=1,
+                        help="cost of a false alarm of the minDCF (default 1)")
+    parser.add_argument("scoreFile")
+    parser.add_argument("keyFile")
+    args = parser.parse_args()
+    if args.debug:
+        DebugFlag = True
+
+    scoreDict = loadTrials(args.scoreFile)
+    keyDict = loadTrials(args.keyFile)
+    debug(f'{len(scoreDict)} scores {len(keyDict)} trials')
+    labels, scores = getLabelsAndScores(scoreDict, keyDict)
+    numTargets = int(np.count_nonzero(labels))
+    if numTargets == 0 or numTargets == len(labels):
+        raise ValueError('the key must have both target and non-target trials')
+
+    eer, eerThreshold = compute_eer(labels, scores)
+    minDcf, minDcfThreshold = compute_minDCF(labels, scores, args.p_target, args.c_miss, args.c_fa)
+
+    print(json.dumps({
+        "eer": eer,
+        "eer_threshold": finiteOrNone(eerThreshold),
+        "min_dcf": minDcf,
+        "min_dcf_threshold": finiteOrNone(minDcfThreshold),
+        "p_target": args.p_target,
+        "target_trials": numTargets,
+        "nontarget_trials": len(labels) - numTargets
+    }))
@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+# persistent cache of the verdicts of the SQA judge, shared by all the
+# submissions: the key is the hash of the context, the question, the
+# normalized answer, the judge model and the version of the judge prompt,
+# so that the answers already judged in a previous submission do not go to
+# the API again
+
+import json
+import time
+import sqlite3
+import hashlib
+
+# the version of the key: the keys of version 1 used the SQuAD
+# normalize_answer, that drops the punctuation ("3.5 million" and
+# "35 million" got the same key) and must not be reused
+KeyVersion = 2
+
+
+def normalize_for_key(answer):
+    # lossless up to case and whitespace: casefold, strip, collapse spaces
+    return " ".join(str(answer).casefold().split())
+
+
+def verdict_key(context, question, answer, model, promptVersion):
+    h = hashlib.sha256()
+    h.update(json.dumps([KeyVersion, context, question, normalize_for_key(answer), model, promptVersion],
+                        ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()
+
+
+class JudgeCache:
+    # sqlite db with a row (is_correct, rationale) for each verdict key;
+    # only the valid verdicts (is_correct true or false) are stored, under
+    # the version of the prompt that gave them (promptVersion by default)
+
+    def __init__(self, dbFile, model, promptVersion):
+        self.model = model
+        self.promptVersion = promptVersion
+        self.hits = 0
+        self.misses = 0
+        # several evaluations can share the same cache file
+        self.conn = sqlite3.connect(dbFile, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " key TEXT PRIMARY KEY,"
+            " is_correct INTEGER NOT NULL,"
+            " rationale TEXT NOT NULL,"
+            " created REAL NOT NULL)")
+        self.conn.commit()
+
+    def key(self, context, question, answer, promptVersion=None):
+        if promptVersion is None:
+            promptVersion = self.promptVersion
+        return verdict_key(context, question, answer, self.model, promptVersion)
+
+    def get(self, context, question, answer, promptVersions=None):
+        # (is_correct, rationale) of the first of promptVersions (default
+        # [promptVersion]) with a verdict, or None
+        for promptVersion in promptVersions or [self.promptVersion]:
+            row = self.conn.execute(
+                "SELECT is_correct, rationale FROM verdicts WHERE key=?",
+                (self.key(context, question, answer, promptVersion),)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return bool(row[0]), row[1]
+        self.misses += 1
+        return None
+
+    def put(self, context, question, answer, is_correct, rationale, promptVersion=None):
+        # committed at once: each verdict is a paid API call
+        self.conn.execute(
+            "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+            (self.key(context, question, answer, promptVersion), int(is_correct), str(rationale),
+             time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
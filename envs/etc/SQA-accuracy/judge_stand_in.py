@@ -0,0 +1,261 @@
+#! /usr/bin/env python
+
+# local stand-in of the judge API for testing and benchmarking
+# run-SQA-accuracy.py without an API key or network access: an
+# OpenAI-compatible chat completions server (stdlib only) on
+#
+#   POST /openai/v1/chat/completions   (the groq client path)
+#   POST /v1/chat/completions          (the openai client path, base url <url>/v1)
+#   GET  /stats                        (counters of the requests, json)
+#
+# with configurable latency, server errors, malformed outputs and rate
+# limits (429 with retry-after and x-ratelimit-* headers); the verdict of
+# an answer is true when its normalized text is in the normalized context
+#
+# with --write-dataset it writes instead a synthetic Spoken-SQuAD
+# reference (ref.json) and prediction (hyp.json) file pair and exits
+
+import re
+import json
+import os, sys
+import time
+import random
+import argparse
+import threading
+
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HF'))
+from compute_score import normalize_answer
+
+
+def debug(msg):
+    if DebugFlag:
+        print(f'{msg}', file=sys.stderr)
+
+
+class StandInState:
+    # the options, the random generator and the counters shared by the
+    # handler threads
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.stats = {"requests": 0, "ok": 0, "rate_limited": 0, "errors": 0,
+                      "malformed": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def draw(self):
+        # (latency, outcome) of a request: "ok", "error", "rate_limited" or "malformed"
+        with self.lock:
+            latency = max(0.0, self.rng.gauss(self.args.latency, self.args.latency_jitter))
+            r = self.rng.random()
+        if r < self.args.error_rate:
+            return latency, "error"
+        r -= self.args.error_rate
+        if r < self.args.rate_limit_rate:
+            return latency, "rate_limited"
+        r -= self.args.rate_limit_rate
+        if r < self.args.malformed_rate:
+            return latency, "malformed"
+        return latency, "ok"
+
+    def take(self):
+        # a request of the --requests-per-minute window: (remaining, reset
+        # seconds), remaining < 0 when the limit is exceeded
+        limit = self.args.requests_per_minute
+        if not limit:
+            return None, None
+        now = time.monotonic()
+        with self.lock:
+            while self.window and now - self.window[0] >= 60.0:
+                self.window.popleft()
+            reset = 60.0 - (now - self.window[0]) if self.window else 0.0
+            if len(self.window) >= limit:
+                return -1, reset
+            self.window.append(now)
+            return limit - len(self.window), reset
+
+
+def judge_answer(context, answer):
+    a = normalize_answer(answer)
+    return a != "" and f' {a} ' in f' {normalize_answer(context)} '
+
+
+def judge_messages(messages):
+    # the output of the judge for the prompts of run-SQA-accuracy.py
+    # (single question or a paragraph batch)
+    user = messages[-1]["content"]
+    m = re.search(r'^Context: "(.*?)"$', user, re.M | re.S)
+    context = m.group(1) if m else ""
+    batchList = re.findall(r'^Answer (\d+): "(.*)"$', user, re.M)
+    if batchList:
+        return json.dumps([{"question": int(n), "correct_answer": judge_answer(context, a),
+                            "rationale": "stand-in verdict"} for n, a in batchList])
+    m = re.search(r'^Answer: "(.*)"$', user, re.M)
+    answer = m.group(1) if m else ""
+    return json.dumps({"correct_answer": judge_answer(context, answer),
+                       "rationale": "stand-in verdict"})
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        debug(fmt % args)
+
+    def send_json(self, code, obj, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        state = self.server.state
+        if self.path.rstrip("/") == "/stats":
+            with state.lock:
+                self.send_json(200, dict(state.stats))
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path not in ("/openai/v1/chat/completions", "/v1/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        state.count("requests")
+        try:
+            request = json.loads(body)
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            state.count("errors")
+            self.send_json(400, {"error": {"message": f'invalid request: {e}'}})
+            return
+
+        latency, outcome = state.draw()
+        time.sleep(latency)
+        remaining, reset = state.take()
+        headers = {}
+        if remaining is not None:
+            headers = {"x-ratelimit-limit-requests": str(state.args.requests_per_minute),
+                       "x-ratelimit-remaining-requests": str(max(remaining, 0)),
+                       "x-ratelimit-reset-requests": f'{reset:.3f}s'}
+        overLimit = remaining is not None and remaining < 0
+        if outcome == "rate_limited" or overLimit:
+            state.count("rate_limited")
+            headers["retry-after"] = f'{reset if overLimit else state.args.retry_after:.3f}'
+            self.send_json(429, {"error": {"message": "rate limit reached", "type": "tokens"}}, headers)
+            return
+        if outcome == "error":
+            state.count("errors")
+            self.send_json(500, {"error": {"message": "internal server error"}}, headers)
+            return
+
+        if outcome == "malformed":
+            state.count("malformed")
+            output = "the answer looks correct"
+        else:
+            output = judge_messages(messages)
+        promptTokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        completionTokens = len(output.split())
+        state.count("ok")
+        state.count("prompt_tokens", promptTokens)
+        state.count("completion_tokens", completionTokens)
+        self.send_json(200, {
+            "id": f'chatcmpl-{state.stats["requests"]}',
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": output}}],
+            "usage": {"prompt_tokens": promptTokens, "completion_tokens": completionTokens,
+                      "total_tokens": promptTokens + completionTokens}
+        }, headers)
+
+
+def writeDataset(outDir, numQuestions, seed, questionsPerParagraph=5):
+    # numQuestions questions with answers that are right (in the context),
+    # wrong, partial or empty
+    rng = random.Random(seed)
+    wordList = [f'word{i}' for i in range(500)]
+    paragraphList = []
+    predictions = {}
+    for p in range((numQuestions + questionsPerParagraph - 1) // questionsPerParagraph):
+        contextWords = rng.choices(wordList, k=120)
+        qaList = []
+        for q in range(min(questionsPerParagraph, numQuestions - p * questionsPerParagraph)):
+            start = rng.randrange(len(contextWords) - 3)
+            gold = " ".join(contextWords[start:start + 3])
+            qid = f'standin{p:05d}q{q}'
+            qaList.append({"id": qid, "question": f'what follows {contextWords[start - 1]}?',
+                           "answers": [{"answer_start": 0, "text": gold}]})
+            r = rng.random()
+            if r < 0.4:
+                predictions[qid] = gold
+            elif r < 0.6:
+                predictions[qid] = " ".join(contextWords[start:start + 2])
+            elif r < 0.9:
+                predictions[qid] = " ".join(rng.choices(wordList, k=3))
+            else:
+                predictions[qid] = ""
+        paragraphList.append({"context": " ".join(contextWords), "qas": qaList})
+    os.makedirs(outDir, exist_ok=True)
+    with open(os.path.join(outDir, "ref.json"), "w") as fp:
+        json.dump({"version": "1.1", "data": [{"title": "stand-in", "paragraphs": paragraphList}]}, fp)
+    with open(os.path.join(outDir, "hyp.json"), "w") as fp:
+        json.dump(predictions, fp)
+
+
+DebugFlag = False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="mean latency of a request in seconds (default 0.2)")
+    parser.add_argument("--latency-jitter", type=float, default=0.05,
+                        help="standard deviation of the latency in seconds (default 0.05)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="fraction of requests answered with a 500 error")
+    parser.add_argument("--rate-limit-rate", type=float, default=0,
+                        help="fraction of requests answered with a 429 error")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="retry-after seconds of those 429 errors (default 1)")
+    parser.add_argument("--requests-per-minute", type=int, default=0,
+                        help="answer with 429 the requests over this limit in the last minute")
+    parser.add_argument("--malformed-rate", type=float, default=0,
+                        help="fraction of requests answered with a non-JSON judge output")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--write-dataset", metavar="DIR",
+                        help="write a synthetic ref.json and hyp.json in DIR and exit")
+    parser.add_argument("--dataset-questions", type=int, default=1000,
+                        help="number of questions of the synthetic dataset (default 1000)")
+    args = parser.parse_args()
+    if args.debug:
+        DebugFlag = True
+
+    if args.write_dataset:
+        writeDataset(args.write_dataset, args.dataset_questions, args.seed)
+        sys.exit(0)
+
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    server.daemon_threads = True
+    server.state = StandInState(args)
+    print(f'judge stand-in on http://{args.host}:{args.port}', file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
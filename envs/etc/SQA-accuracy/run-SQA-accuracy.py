@@ -1,24 +1,332 @@
 import argparse
+import asyncio
+import inspect
+import itertools
 import json
+import math
 import os, sys
+import random
+import re
+import time
 from pathlib import Path
+from statistics import NormalDist
 
 import groq
+import httpx
 from tqdm import tqdm
 
+from judge_cache import JudgeCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HF'))
+from compute_score import normalize_answer, exact_match_score, metric_max_over_ground_truths
+
 debugFlag = False
-groq_client = groq.Groq(
-    api_key=os.environ["GROQ_API_KEY"], timeout=5.0, max_retries=6
-)
+
+# the requests to the judge are retried (with exponential backoff) on rate
+# limits, timeouts, connection and server errors by create_completion
+MaxAttempts = 7
+RequestTimeout = 5.0
+
+# the default judge backend (see Judge), and the version of its prompt:
+# change the version when the prompt of evaluate_answer changes, so that
+# the cached verdicts of the old prompt are not reused
+DefaultJudgeModel = "llama3-70b-8192"
+DefaultApiKeyEnv = "GROQ_API_KEY"
+JudgePromptVersion = 1
+# the same for the prompt of evaluate_paragraph; its verdicts are cached
+# under BatchCacheVersion, apart from the per-question ones
+BatchPromptVersion = 1
+BatchCacheVersion = f'{JudgePromptVersion}+batch{BatchPromptVersion}'
 
 def debug(msg):
     if debugFlag:
         print(f'{msg}', file=sys.stderr)
 
-def evaluate_answer(context, question, answer):
+def parse_duration(s):
+    # the durations of the rate-limit headers, e.g. "7.66", "1m2.5s", "120ms"
+    if s is None:
+        return None
     try:
-        chat_completion = groq_client.chat.completions.create(
-            model="llama3-70b-8192",
+        return float(s)
+    except ValueError:
+        pass
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', s)
+    if not parts:
+        return None
+    return sum(float(v) * units[u] for v, u in parts)
+
+class RateLimiter:
+    """
+    token bucket of the requests sent to the judge: at most `rate` requests
+    per second (0 = no limit) in bursts of at most `burst` requests; the
+    retry-after and x-ratelimit-* headers of the responses pause the bucket
+    until the provider resets its limits
+    """
+    def __init__(self, rate=0.0, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.pauseUntil = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # the lock keeps the waiting requests in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.pauseUntil:
+                    await asyncio.sleep(self.pauseUntil - now)
+                    continue
+                if self.rate > 0:
+                    self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                    self.last = now
+                    if self.tokens < 1:
+                        await asyncio.sleep((1 - self.tokens) / self.rate)
+                        continue
+                    self.tokens -= 1
+                return
+
+    def pause(self, seconds):
+        until = time.monotonic() + seconds
+        if until > self.pauseUntil:
+            debug(f'rate limiter: pausing {seconds:.2f}s')
+            self.pauseUntil = until
+
+    def update(self, headers, usedTokens=0):
+        retryAfter = parse_duration(headers.get("retry-after"))
+        if retryAfter is not None:
+            self.pause(retryAfter)
+        for kind, needed in (("requests", 1), ("tokens", usedTokens)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            # not enough left for another request like the last one
+            if remaining < max(needed, 1):
+                self.pause(reset)
+
+class Judge:
+    """
+    the judge backend: an OpenAI-compatible chat completions client, the
+    module of its exceptions (api: groq or openai), the judge model and the
+    rate limiter of its requests.  The groq client sends the requests to
+    <base url>/openai/v1/chat/completions, the openai one to
+    <base url>/chat/completions (e.g. https://host/v1 for vLLM or OpenAI)
+    """
+    def __init__(self, client, api, model, limiter):
+        self.client = client
+        self.api = api
+        self.model = model
+        self.limiter = limiter
+
+def make_judge(baseUrl=None, model=DefaultJudgeModel, apiKeyEnv=DefaultApiKeyEnv,
+               concurrency=8, requestsPerSecond=0, clientKind="groq"):
+    # without baseUrl the client uses $GROQ_BASE_URL or the Groq API
+    # (groq), $OPENAI_BASE_URL or the OpenAI API (openai)
+    if clientKind == "openai":
+        # only needed by this backend
+        import openai as api
+        clientClass = api.AsyncOpenAI
+    else:
+        api = groq
+        clientClass = groq.AsyncGroq
+    # a pooled connection for each request in flight
+    http_client = api.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+    client = clientClass(
+        api_key=os.environ[apiKeyEnv], base_url=baseUrl, timeout=RequestTimeout,
+        max_retries=0, http_client=http_client
+    )
+    return Judge(client, api, model, RateLimiter(requestsPerSecond, concurrency))
+
+class JudgeTelemetry:
+    """
+    a record for each judged question: latency (seconds from the first
+    request to the verdict, rate-limit waits and retries included), tokens,
+    attempts and failed attempts (by kind) of its requests, and the parse
+    path of the judge output; written as JSONL to telemetryFile (when given)
+    and summarized in the result JSON.  The questions judged together in a
+    paragraph request get an equal share (1/batch_size) of its counters
+    """
+    Counters = ("attempts", "rate_limited", "server_errors", "client_errors", "timeouts",
+                "connection_errors", "other_errors", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, telemetryFile=None):
+        self.recordList = []
+        self.fp = open(telemetryFile, "a", encoding='utf-8') if telemetryFile else None
+
+    def record(self, question_id, latency, stats, share=None, batchSize=1):
+        rec = {"id": question_id, "latency": round(latency, 4),
+               "parse": stats.get("parse", "none"), "batch_size": batchSize}
+        for k in self.Counters:
+            v = stats.get(k, 0)
+            if share is not None:
+                v += share.get(k, 0) / batchSize
+            rec[k] = round(v, 4) if isinstance(v, float) else v
+        retries = max(0, stats.get("attempts", 0) - 1)
+        if share is not None:
+            retries += max(0, share.get("attempts", 0) - 1) / batchSize
+        rec["retries"] = round(retries, 4) if isinstance(retries, float) else retries
+        self.recordList.append(rec)
+        if self.fp is not None:
+            self.fp.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def summary(self):
+        def percentile(sortedList, q):
+            # nearest rank
+            if not sortedList:
+                return None
+            return sortedList[max(0, math.ceil(q / 100 * len(sortedList)) - 1)]
+
+        # the cache hits make no request
+        latencyList = sorted(r["latency"] for r in self.recordList if r["parse"] != "cache")
+        # judge_verdicts: the verdicts of this run, cache hits included (not
+        # the judged_questions of the result, i.e. not decided lexically)
+        res = {"judge_verdicts": len(self.recordList),
+               "cache_hits": sum(1 for r in self.recordList if r["parse"] == "cache"),
+               "latency_p50": percentile(latencyList, 50),
+               "latency_p95": percentile(latencyList, 95),
+               "latency_p99": percentile(latencyList, 99),
+               "latency_max": latencyList[-1] if latencyList else None}
+        for k in self.Counters + ("retries",):
+            res[k] = round(sum(r[k] for r in self.recordList), 2)
+        res["total_tokens"] = round(res["prompt_tokens"] + res["completion_tokens"], 2)
+        parseCnt = {}
+        for r in self.recordList:
+            parseCnt[r["parse"]] = parseCnt.get(r["parse"], 0) + 1
+        res["parse"] = parseCnt
+        return res
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+def is_retryable(e, api=groq):
+    # api: the module of the client exceptions (see Judge)
+    if isinstance(e, (api.APITimeoutError, api.APIConnectionError)):
+        return True
+    if isinstance(e, api.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+def error_kind(e, api=groq):
+    # the telemetry counter of a failed request
+    if isinstance(e, api.APITimeoutError):
+        return "timeouts"
+    if isinstance(e, api.APIConnectionError):
+        return "connection_errors"
+    if isinstance(e, api.APIStatusError):
+        if e.status_code == 429:
+            return "rate_limited"
+        if e.status_code >= 500:
+            return "server_errors"
+        if e.status_code >= 400:
+            # bad request, auth, unknown model: not retried
+            return "client_errors"
+    return "other_errors"
+
+async def create_completion(judge, stats=None, **kwargs):
+    # the client has max_retries=0: the retries are done here, so that the
+    # rate limiter sees the headers of every response; the attempts, the
+    # failures and the tokens are added to stats
+    if stats is None:
+        stats = {}
+    limiter = judge.limiter
+    for attempt in range(MaxAttempts):
+        await limiter.acquire()
+        stats["attempts"] = stats.get("attempts", 0) + 1
+        try:
+            raw = await judge.client.chat.completions.with_raw_response.create(
+                model=judge.model, **kwargs)
+        except Exception as e:
+            kind = error_kind(e, judge.api)
+            stats[kind] = stats.get(kind, 0) + 1
+            if not is_retryable(e, judge.api) or attempt == MaxAttempts - 1:
+                raise
+            if isinstance(e, judge.api.APIStatusError):
+                limiter.update(e.response.headers)
+            delay = min(60.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            debug(f'create_completion: attempt {attempt + 1} failed ({e}), retry in {delay:.2f}s')
+            await asyncio.sleep(delay)
+            continue
+        # a coroutine with the groq client, the completion with the openai one
+        chat_completion = raw.parse()
+        if inspect.isawaitable(chat_completion):
+            chat_completion = await chat_completion
+        usage = getattr(chat_completion, "usage", None)
+        for k in ("prompt_tokens", "completion_tokens"):
+            stats[k] = stats.get(k, 0) + (getattr(usage, k, 0) or 0)
+        limiter.update(raw.headers, getattr(usage, "total_tokens", 0) or 0)
+        return chat_completion
+
+def lexical_verdict(answer, ground_truths):
+    # the verdict of the clear-cut answers, without the judge: "empty" for
+    # the empty (after SQuAD normalization) or "None" answers, "exact_match"
+    # for the answers equal to a gold answer; None for the others
+    if answer is None or str(answer).strip() == "None" or normalize_answer(str(answer)) == "":
+        return False, "empty"
+    if ground_truths and metric_max_over_ground_truths(exact_match_score, str(answer), ground_truths):
+        return True, "exact_match"
+    return None
+
+def load_judge_json(output, stats=None):
+    # the json of the judge output, or None, "Invalid JSON string", output;
+    # the parse path (json, unicode_escape or invalid_json) goes in stats
+    if stats is None:
+        stats = {}
+    try:
+        stats["parse"] = "json"
+        return json.loads(output), None
+    except json.JSONDecodeError:
+        out2 = output.encode('unicode_escape').decode('ASCII')
+        try:
+            output_json = json.loads(out2)
+        except json.JSONDecodeError:
+            stats["parse"] = "invalid_json"
+            return None, (None, "Invalid JSON string", output + out2)
+        debug("  out2 is OK")
+        stats["parse"] = "unicode_escape"
+        return output_json, None
+
+def parse_judge_output(output, stats=None):
+    if stats is None:
+        stats = {}
+    output_json, error = load_judge_json(output, stats)
+    if error is not None:
+        return error
+    if not isinstance(output_json, dict) or "correct_answer" not in output_json:
+        debug("Invalid judge output.")
+        stats["parse"] = "invalid_value"
+        return None, "Invalid correct_answer value", output
+    if not isinstance(output_json["correct_answer"], bool):
+        debug("Invalid correct_answer value.")
+        stats["parse"] = "invalid_value"
+        return None, "Invalid correct_answer value", output
+    is_correct = output_json["correct_answer"]
+    rationale = output_json.get("rationale", "")
+    return is_correct, rationale, output
+
+async def evaluate_answer(judge, context, question, answer, cache=None, stats=None):
+    # stats: the telemetry of the question (see JudgeTelemetry)
+    if stats is None:
+        stats = {}
+    if cache is not None:
+        verdict = cache.get(context, question, answer)
+        if verdict is not None:
+            stats["parse"] = "cache"
+            is_correct, rationale = verdict
+            return is_correct, rationale, json.dumps(
+                {"correct_answer": is_correct, "rationale": rationale}, ensure_ascii=False)
+    try:
+        chat_completion = await create_completion(
+            judge, stats,
             messages=[
                 {
                     "role": "system",
@@ -56,53 +364,259 @@ def evaluate_answer(context, question, answer):
         )
     except Exception as e:
         debug(f'evaluate_answer: exception {e}.')
+        stats["parse"] = "api_error"
         return None, "Low level error", None
     output = chat_completion.choices[0].message.content
-    try:
-        output_json = json.loads(output)
-    except json.JSONDecodeError:
-        out2 = output.encode('unicode_escape').decode('ASCII')
-        try:
-            output_json = json.loads(out2)
-        except json.JSONDecodeError:
-            return None, "Invalid JSON string", output + out2
-        debug("  out2 is OK")
-    if not isinstance(output_json["correct_answer"], bool):
-        debug("Invalid correct_answer value.")
-        return None, "Invalid correct_answer value", output
-    is_correct = output_json["correct_answer"]
-    rationale = output_json["rationale"]
+    is_correct, rationale, output = parse_judge_output(output, stats)
+    if cache is not None and is_correct is not None:
+        cache.put(context, question, answer, is_correct, rationale)
     return is_correct, rationale, output
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-d", "--debug", action="store_true")
-    parser.add_argument("-r", "--reference-file", type=Path)
-    parser.add_argument("-p", "--prediction-file", type=Path)
-    parser.add_argument("-o", "--output-file", type=Path)
-    parser.add_argument("-s", "--save-step", type=int, help="default 1000")
-    args = parser.parse_args()
-    if args.debug:
-        global debugFlag
-        debugFlag = True
+def wilson_interval(k, n, z):
+    # Wilson score interval of a proportion k/n
+    if n == 0:
+        return 0.0, 1.0
+    p = k / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    half = z * (p * (1 - p) / n + z * z / (4 * n * n)) ** 0.5 / denom
+    return max(0.0, center - half), min(1.0, center + half)
+
+class OutcomeJournal:
+    """
+    append-only JSONL journal of the outcomes of the questions, one
+    {"id": ..., "outcome": ...} record per line: the records are flushed
+    at once and fsync'ed every `syncStep` records, so that a checkpoint
+    costs O(1) and a crash loses at most the records not yet synced
+    """
+    def __init__(self, journalFile, syncStep=200):
+        self.journalFile = journalFile
+        self.syncStep = max(1, syncStep)
+        self.unsynced = 0
+        self.fp = None
+        self.cutLine = False
+
+    def replay(self, outcomeDict):
+        # add the records of a previous (interrupted) run to outcomeDict
+        if not self.journalFile.exists():
+            return 0
+        cnt = 0
+        with open(self.journalFile, encoding='utf-8') as fp:
+            for line in fp:
+                self.cutLine = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a record cut by a crash (the last one)
+                    debug('journal: skipping truncated record')
+                    continue
+                outcomeDict[record["id"]] = record["outcome"]
+                cnt += 1
+        return cnt
+
+    def append(self, question_id, outcome):
+        if self.fp is None:
+            self.fp = open(self.journalFile, "a", encoding='utf-8')
+            if self.cutLine:
+                # never append to a truncated record
+                self.fp.write("\n")
+        self.fp.write(json.dumps({"id": question_id, "outcome": outcome}, ensure_ascii=False) + "\n")
+        self.fp.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.syncStep:
+            self.sync()
+
+    def sync(self):
+        if self.fp is not None and self.unsynced > 0:
+            os.fsync(self.fp.fileno())
+            self.unsynced = 0
+
+    def compact(self, outputFile, outcomeDict):
+        # write all the outcomes in outputFile (atomically) and drop the journal
+        tmpFile = outputFile.with_name(outputFile.name + ".tmp")
+        with open(tmpFile, "w", encoding='utf-8') as fp:
+            fp.write(json.dumps(outcomeDict, ensure_ascii=False, indent=2))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpFile, outputFile)
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        self.journalFile.unlink(missing_ok=True)
+
+def parse_batch_output(output, numQuestions, stats=None):
+    # the verdicts of a JSON array of {"question": <N>, "correct_answer":
+    # <true/false>, "rationale": <RATIONALE>}, a None for each question
+    # without a valid verdict, or None when the output is not an array
+    output_json, error = load_judge_json(output, stats)
+    if error is not None:
+        return None
+    if isinstance(output_json, dict) and len(output_json) == 1:
+        # the array wrapped in an object, e.g. {"verdicts": [...]}
+        output_json = next(iter(output_json.values()))
+    if not isinstance(output_json, list):
+        return None
+    verdictList = [None] * numQuestions
+    for i, item in enumerate(output_json):
+        if not isinstance(item, dict):
+            continue
+        n = item.get("question", i + 1)
+        if not isinstance(n, int) or not 1 <= n <= numQuestions or verdictList[n - 1] is not None:
+            continue
+        if not isinstance(item.get("correct_answer"), bool):
+            continue
+        verdictList[n - 1] = (item["correct_answer"], item.get("rationale", ""),
+                              json.dumps(item, ensure_ascii=False))
+    return verdictList
+
+async def evaluate_paragraph(judge, context, itemList, cache=None, telemetry=None):
+    # judge all the (question_id, question, answer) of itemList, with the
+    # same context, in a single request; the questions without a valid
+    # verdict in the response (or all of them, when the request fails or
+    # the response is not a JSON array) fall back to evaluate_answer
+    startTime = time.monotonic()
+    resList = [None] * len(itemList)
+    pendingList = []
+    for i, (question_id, question, answer) in enumerate(itemList):
+        # a verdict of either prompt saves the request
+        verdict = None
+        if cache is not None:
+            verdict = cache.get(context, question, answer, [BatchCacheVersion, JudgePromptVersion])
+        if verdict is not None:
+            if telemetry is not None:
+                telemetry.record(question_id, time.monotonic() - startTime, {"parse": "cache"})
+            is_correct, rationale = verdict
+            resList[i] = (question_id, (is_correct, rationale, json.dumps(
+                {"correct_answer": is_correct, "rationale": rationale}, ensure_ascii=False)))
+        else:
+            pendingList.append(i)
+
+    verdictList = None
+    batchStats = {}
+    if len(pendingList) > 1:
+        lineList = [f"Context: \"{context}\""]
+        for n, i in enumerate(pendingList, 1):
+            _, question, answer = itemList[i]
+            lineList.append(f"Question {n}: \"{question}\"")
+            lineList.append(f"Answer {n}: \"{answer}\"")
+        try:
+            chat_completion = await create_completion(
+                judge, batchStats,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "You are a helpful assistant that evaluates answers to "
+                            "questions given a certain context. You will be given "
+                            "inputs of the form: \n"
+                            "Context: <CONTEXT>\n"
+                            "Question 1: <QUESTION>\n"
+                            "Answer 1: <ANSWER>\n"
+                            "Question 2: <QUESTION>\n"
+                            "Answer 2: <ANSWER>\n"
+                            "...\n"
+                            "Your task is to determine, for each question, if the "
+                            "given answer is correct or not, assuming the correct "
+                            "answer is contained in the context.\n"
+                            "Your response should be formatted as a JSON array "
+                            "with an element for each question, in order, having "
+                            "the following structure: \n"
+                            "[{\"question\": <N>, \"correct_answer\": <true/false>, "
+                            "\"rationale\": <RATIONALE>}, ...]\n"
+                            "where 'rationale' must be a string explaining why the "
+                            "answer is correct or incorrect. If you need to include "
+                            "double quote characters (\") in the 'rationale' string, "
+                            "you must escape them with a backslash (\\). For example, "
+                            "if you want to include the string \"Hello, World!\", you "
+                            "should write it as \\\"Hello, World!\\\"."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": "\n".join(lineList),
+                    },
+                ],
+                seed=42,
+            )
+            verdictList = parse_batch_output(chat_completion.choices[0].message.content,
+                                             len(pendingList), batchStats)
+        except Exception as e:
+            debug(f'evaluate_paragraph: exception {e}.')
+        if verdictList is None:
+            batchStats["parse"] = "invalid_array"
+            debug(f'evaluate_paragraph: invalid response, judging {len(pendingList)} questions one by one')
+
+    for n, i in enumerate(pendingList):
+        question_id, question, answer = itemList[i]
+        verdict = verdictList[n] if verdictList is not None else None
+        stats = {}
+        if verdict is None:
+            verdict = await evaluate_answer(judge, context, question, answer, cache, stats)
+            if batchStats:
+                stats["parse"] = "batch_fallback_" + stats.get("parse", "none")
+        else:
+            stats["parse"] = "batch"
+            if cache is not None:
+                cache.put(context, question, answer, verdict[0], verdict[1], BatchCacheVersion)
+        if telemetry is not None:
+            if batchStats:
+                telemetry.record(question_id, time.monotonic() - startTime, stats,
+                                 batchStats, len(pendingList))
+            else:
+                telemetry.record(question_id, time.monotonic() - startTime, stats)
+        resList[i] = (question_id, verdict)
+    return resList
+
+async def evaluate_answers(judge, todoList, concurrency, cache=None, batch=False, telemetry=None):
+    # judge the (question_id, context, question, answer) of todoList with at
+    # most `concurrency` requests in flight, yielding the outcomes as they
+    # complete; with batch the questions of each paragraph (consecutive in
+    # todoList) are judged together
+    semaphore = asyncio.Semaphore(concurrency)
 
+    async def evaluate(question_id, context, question, answer):
+        async with semaphore:
+            startTime = time.monotonic()
+            stats = {}
+            verdict = await evaluate_answer(judge, context, question, answer, cache, stats)
+            if telemetry is not None:
+                telemetry.record(question_id, time.monotonic() - startTime, stats)
+            return [(question_id, verdict)]
+
+    async def evaluate_group(context, itemList):
+        async with semaphore:
+            return await evaluate_paragraph(judge, context, itemList, cache, telemetry)
+
+    if batch:
+        taskList = [evaluate_group(context, [(q_id, q, a) for q_id, _, q, a in group])
+                    for context, group in itertools.groupby(todoList, key=lambda todo: todo[1])]
+    else:
+        taskList = [evaluate(*todo) for todo in todoList]
+    for future in asyncio.as_completed(taskList):
+        for res in await future:
+            yield res
+
+async def run(args):
     dataset = json.loads(args.reference_file.read_text())["data"]
     predictions = json.loads(args.prediction_file.read_text())
     evaluation_outcome = {}
     if args.output_file.exists():
         evaluation_outcome = json.loads(args.output_file.read_text())
-    debug(f'initialized evaluation_outcome {len(evaluation_outcome)}')
+    journal = OutcomeJournal(args.output_file.with_name(args.output_file.name + ".journal"),
+                             args.save_step or 200)
+    replayCnt = journal.replay(evaluation_outcome)
+    debug(f'initialized evaluation_outcome {len(evaluation_outcome)} ({replayCnt} from the journal)')
 
     doneCnt  = 0
     predTodo = len(predictions)
-    saveStep = 200
     cntTrue  = 0
     cntFalse = 0
     cntNone  = 0
     cntSkip  = 0
-    if args.save_step:
-       saveStep = args.save_step
     args.output_file.parent.mkdir(exist_ok=True, parents=True)
+    todoList = []
+    # all the questions to score (also the already evaluated ones), for the preview
+    sampleList = []
     for article in dataset:
         debug(f'scan paragraph {len(article["paragraphs"])}')
         for paragraph in article["paragraphs"]:
@@ -117,36 +631,101 @@ def main():
                     # questions in the dataset may not be present in the
                     # predictions.
                     continue
+                sampleList.append(question_id)
                 if question_id in evaluation_outcome:
                     debug(f'already evaluated {question_id}')
                     continue
-                question = qa["question"]
-                is_correct, rationale, raw_api_output = evaluate_answer(
-                    context=context,
-                    question=question,
-                    answer=predictions[question_id],
-                )
-                if raw_api_output is None:
-                    debug(f'skipping {question_id}: reason {rationale}')
-                    cntSkip += 1
-                    continue
-                evaluation_outcome[question_id] = {
-                   "is_correct": is_correct
-                }
-                if is_correct is None:
-                    debug(f'None is_correct {question_id}: reason {rationale}, raw_api_output {raw_api_output}')
-                    evaluation_outcome[question_id]["raw_api_output"] = raw_api_output
-                    evaluation_outcome[question_id]["error"] = rationale
-                doneCnt += 1
-                # save every saveStep
-                if ((doneCnt + cntSkip) % saveStep) == 1:
-                    args.output_file.write_text(json.dumps(evaluation_outcome, ensure_ascii=False, indent=2))
-                    debug(f'saved {doneCnt + cntSkip} {len(evaluation_outcome)}')
-
-    args.output_file.write_text(
-        json.dumps(evaluation_outcome, ensure_ascii=False, indent=2)
-    )
+                if args.lexical_fast_path:
+                    ground_truths = [a["text"] for a in qa.get("answers", [])]
+                    verdict = lexical_verdict(predictions[question_id], ground_truths)
+                    if verdict is not None:
+                        evaluation_outcome[question_id] = {
+                           "is_correct": verdict[0],
+                           "lexical": verdict[1]
+                        }
+                        journal.append(question_id, evaluation_outcome[question_id])
+                        continue
+                todoList.append((question_id, context, qa["question"], predictions[question_id]))
+    debug(f'{len(todoList)} questions to evaluate, {args.concurrency} in flight')
+
+    judge = make_judge(args.judge_base_url, args.judge_model, args.judge_api_key_env,
+                       args.concurrency, args.requests_per_second, args.judge_client)
+    cache = None
+    if args.cache_file:
+        args.cache_file.parent.mkdir(exist_ok=True, parents=True)
+        # evaluate_paragraph files its own verdicts under BatchCacheVersion
+        cache = JudgeCache(args.cache_file, args.judge_model, JudgePromptVersion)
+    telemetry = None
+    if args.telemetry or args.telemetry_file:
+        telemetry = JudgeTelemetry(args.telemetry_file)
+
+    def record(question_id, is_correct, rationale, raw_api_output):
+        nonlocal doneCnt, cntSkip
+        if raw_api_output is None:
+            debug(f'skipping {question_id}: reason {rationale}')
+            cntSkip += 1
+            return
+        evaluation_outcome[question_id] = {
+           "is_correct": is_correct
+        }
+        if is_correct is None:
+            debug(f'None is_correct {question_id}: reason {rationale}, raw_api_output {raw_api_output}')
+            evaluation_outcome[question_id]["raw_api_output"] = raw_api_output
+            evaluation_outcome[question_id]["error"] = rationale
+        journal.append(question_id, evaluation_outcome[question_id])
+        doneCnt += 1
+
+    preview = None
+    async with judge.client:
+        if args.preview_width:
+            # judge a reproducible random sample, a round of `concurrency`
+            # questions at a time, until the confidence interval of the
+            # accuracy is narrower than preview_width; the skipped questions
+            # count as not correct, as in the accuracy
+            random.Random(args.preview_seed).shuffle(sampleList)
+            todoDict = {todo[0]: todo for todo in todoList}
+            z = NormalDist().inv_cdf(0.5 + args.preview_confidence / 2)
+            n = k = 0
+            low, high = 0.0, 1.0
+            for pos in range(0, len(sampleList), args.concurrency):
+                roundList = sampleList[pos:pos + args.concurrency]
+                async for question_id, verdict in evaluate_answers(
+                        judge, [todoDict[q] for q in roundList if q in todoDict],
+                        args.concurrency, cache, args.batch_paragraphs, telemetry):
+                    record(question_id, *verdict)
+                n += len(roundList)
+                k += sum(1 for q in roundList
+                         if q in evaluation_outcome and evaluation_outcome[q]["is_correct"] is True)
+                low, high = wilson_interval(k, n, z)
+                debug(f'preview: {k}/{n} interval [{low:.4f}, {high:.4f}]')
+                if n >= args.preview_min_questions and (high - low) * 100 < args.preview_width:
+                    break
+            # no sample (no questions in the input): a null preview
+            preview = {"accuracy": f'{k / n * 100:.2f}' if n > 0 else None,
+                       "accuracy_ci_low": f'{low * 100:.2f}' if n > 0 else None,
+                       "accuracy_ci_high": f'{high * 100:.2f}' if n > 0 else None,
+                       "confidence": f'{args.preview_confidence}',
+                       "input_questions": f'{predTodo}',
+                       "preview_questions": f'{n}'}
+        else:
+            async for question_id, verdict in evaluate_answers(
+                    judge, todoList, args.concurrency, cache, args.batch_paragraphs, telemetry):
+                record(question_id, *verdict)
+
+    journal.compact(args.output_file, evaluation_outcome)
     debug(f'saved {doneCnt} {len(evaluation_outcome)}')
+    if cache is not None:
+        debug(f'judge cache: {cache.hits} hits {cache.misses} misses')
+        cache.close()
+    if telemetry is not None:
+        telemetry.close()
+    if preview is not None:
+        # the verdicts of the preview stay in the output file (and in the
+        # cache) for a later full run
+        if telemetry is not None:
+            preview["telemetry"] = telemetry.summary()
+        print(json.dumps(preview))
+        return
     for id in evaluation_outcome:
         is_correct = evaluation_outcome[id]["is_correct"]
         if is_correct is None:
@@ -160,12 +739,79 @@ def main():
     accStr = f'{accuracy:.2f}'
     inQStr = f'{predTodo}'
     evQStr = f'{cntTrue + cntFalse}'
-    res = {"accuracy":  accStr, 
+    res = {"accuracy":  accStr,
            "input_questions": inQStr,
            "evaluated_questions": evQStr}
+    if args.lexical_fast_path:
+        # the questions of each path (as the other counts)
+        pathCnt = {"exact_match": 0, "empty": 0}
+        for id in evaluation_outcome:
+            if "lexical" in evaluation_outcome[id]:
+                pathCnt[evaluation_outcome[id]["lexical"]] += 1
+        res["exact_match_questions"] = f'{pathCnt["exact_match"]}'
+        res["empty_answer_questions"] = f'{pathCnt["empty"]}'
+        res["judged_questions"] = f'{len(evaluation_outcome) - pathCnt["exact_match"] - pathCnt["empty"]}'
+    if telemetry is not None:
+        # the questions judged in this run
+        res["telemetry"] = telemetry.summary()
     print(json.dumps(res))
-    
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--debug", action="store_true")
+    parser.add_argument("-r", "--reference-file", type=Path)
+    parser.add_argument("-p", "--prediction-file", type=Path)
+    parser.add_argument("-o", "--output-file", type=Path)
+    parser.add_argument("-s", "--save-step", type=int,
+                        help="fsync the journal of the outcomes every save-step questions (default 200)")
+    parser.add_argument("--judge-client", choices=["groq", "openai"], default="groq",
+                        help="client of the judge API (default groq): the groq one sends the requests "
+                             "to <url>/openai/v1/chat/completions, the openai one to <url>/chat/completions")
+    parser.add_argument("--judge-base-url",
+                        help="base url of the judge API (default $GROQ_BASE_URL or the Groq API for "
+                             "the groq client, $OPENAI_BASE_URL or the OpenAI API for the openai one)")
+    parser.add_argument("--judge-model", default=DefaultJudgeModel,
+                        help=f"judge model (default {DefaultJudgeModel})")
+    parser.add_argument("--judge-api-key-env", default=DefaultApiKeyEnv,
+                        help=f"environment variable with the API key of the judge (default {DefaultApiKeyEnv})")
+    parser.add_argument("-c", "--concurrency", type=int, default=8,
+                        help="max number of judge requests in flight (default 8)")
+    parser.add_argument("--requests-per-second", type=float, default=0,
+                        help="max rate of the judge requests (default 0: limited only "
+                             "by the rate-limit headers of the provider)")
+    parser.add_argument("-l", "--lexical-fast-path", action="store_true",
+                        help="mark the answers matching a gold answer (SQuAD exact match) as "
+                             "correct and the empty or \"None\" answers as incorrect, "
+                             "without the judge")
+    parser.add_argument("-b", "--batch-paragraphs", action="store_true",
+                        help="judge all the questions of a paragraph in a single request "
+                             "(falling back to a request per question when the response "
+                             "cannot be parsed)")
+    parser.add_argument("-w", "--preview-width", type=float,
+                        help="preview: judge a random sample of the questions until the "
+                             "confidence interval of the accuracy is narrower than this "
+                             "width (in accuracy points, e.g. 5)")
+    parser.add_argument("--preview-confidence", type=float, default=0.95,
+                        help="confidence level of the preview interval (default 0.95)")
+    parser.add_argument("--preview-seed", type=int, default=42,
+                        help="seed of the preview sample (default 42)")
+    parser.add_argument("--preview-min-questions", type=int, default=30,
+                        help="min number of questions of the preview (default 30)")
+    parser.add_argument("-t", "--telemetry", action="store_true",
+                        help="add a summary of the judge telemetry (latency percentiles, "
+                             "tokens, retries, parse paths) to the result JSON")
+    parser.add_argument("--telemetry-file", type=Path,
+                        help="append the telemetry of each judged question to this JSONL "
+                             "file (implies --telemetry)")
+    parser.add_argument("--cache-file", type=Path,
+                        help="sqlite file with the verdicts of the previous evaluations")
+    args = parser.parse_args()
+    if args.debug:
+        global debugFlag
+        debugFlag = True
+
+    asyncio.run(run(args))
+
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+
+# transcribe with whisper and score with UTMOS all the files of a wav dir,
+# decoding (and resampling) each file only once:
+#
+#   decoder threads --+--> asr queue --> whisper   --> <output_dir>/<name>.txt
+#                     |
+#                     +--> mos queue --> utmos     --> scores (mean stdev)
+#
+# the two models run in their own thread, so ASR and MOS overlap;
+# with a cache file (see tts_cache.py) only the files never seen before by
+# the models are decoded and processed
+
+import sys
+import json
+import queue
+import torch
+import argparse
+import threading
+import statistics
+
+from os import listdir, makedirs
+from os.path import isfile, join, basename, splitext, dirname, abspath
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', 'UTMOS'))
+from audio_io import getAudioInfo, loadAudio
+from compute_utmos_from_dir import makeBuckets
+from model_registry import loadUtmos, loadWhisper, UtmosRepo, UtmosModel
+from tts_cache import hashFile, ResultCache
+
+
+# both whisper and UTMOS work at 16 kHz
+TargetSr = 16000
+
+# the model ids used in the cache keys
+MosModelId = f'{UtmosModel}@{UtmosRepo}'
+
+
+def debug(msg):
+  if DebugFlag:
+    print(f'{msg}', file=sys.stderr)
+
+
+def decodeFile(audioF, cacheDir=None, audioKey=None):
+  wave, _ = loadAudio(audioF, sr=TargetSr, cacheDir=cacheDir, audioKey=audioKey)
+  return wave
+
+
+def writeTranscription(outDir, f, lineList):
+  traF = join(outDir, splitext(basename(f))[0] + '.txt')
+  with open(traF, 'w', encoding='utf-8') as fp:
+    for line in lineList:
+      print(line, file=fp)
+
+
+def producer(bucketList, needAsr, needMos, asrQueue, mosQueue, numWorkers, cacheDir, hashDict):
+  # decode the buckets (in duration order) and feed the stages that need
+  # each file
+  try:
+    with ThreadPoolExecutor(max_workers=numWorkers) as pool:
+      for bucket in bucketList:
+        fileList = [f for f, _, _ in bucket]
+        waveList = list(pool.map(decodeFile, fileList, [cacheDir] * len(fileList),
+                                 [hashDict.get(f) for f in fileList]))
+        for (f, _, _), wave in zip(bucket, waveList):
+          if f in needAsr:
+            asrQueue.put((f, wave))
+        mosList = [(f, wave) for (f, _, _), wave in zip(bucket, waveList) if f in needMos]
+        if mosList:
+          mosQueue.put(mosList)
+  finally:
+    asrQueue.put(None)
+    mosQueue.put(None)
+
+
+def asrConsumer(model, asrQueue, outDir, lang, device, asrResList, errorList):
+  # same decoding options of the whisper command line
+  options = {"task": "transcribe", "language": lang, "beam_size": 5,
+             "best_of": 5, "fp16": device == "cuda"}
+  while True:
+    item = asrQueue.get()
+    if item is None:
+      break
+    if errorList:
+      # keep draining the queue so that the producer never blocks
+      continue
+    f, wave = item
+    try:
+      result = model.transcribe(wave, **options)
+      lineList = [segment["text"].strip() for segment in result["segments"]]
+      writeTranscription(outDir, f, lineList)
+      asrResList.append((f, lineList))
+      debug(f'transcribed {f}')
+    except Exception as e:
+      errorList.append(e)
+
+
+def mosConsumer(predictor, mosQueue, device, resList, errorList):
+  while True:
+    item = mosQueue.get()
+    if item is None:
+      break
+    if errorList:
+      continue
+    try:
+      maxLen = max(len(w) for _, w in item)
+      batch = torch.zeros(len(item), maxLen)
+      for i, (_, w) in enumerate(item):
+        batch[i, :len(w)] = torch.from_numpy(w)
+      with torch.inference_mode():
+        scores = predictor(batch.to(device), TargetSr)
+      for (f, _), s in zip(item, scores.tolist()):
+        resList.append((f, float(s)))
+        debug(f'utmos {f} {float(s)}')
+    except Exception as e:
+      errorList.append(e)
+
+
+DebugFlag = False
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--debug", action="store_true")
+  parser.add_argument("-l", "--language", required=True)
+  parser.add_argument("-o", "--output-dir", required=True,
+                      help="dir of the transcriptions (one <name>.txt for each wav)")
+  parser.add_argument("-m", "--model", default="large", help="whisper model (default large)")
+  parser.add_argument("-b", "--batch-size", type=int, default=16)
+  parser.add_argument("-p", "--max-pad-ratio", type=float, default=0.02,
+                      help="max fraction of zero padding in a UTMOS batch (default 0.02)")
+  parser.add_argument("-w", "--num-workers", type=int, default=4,
+                      help="number of audio decoding threads (default 4)")
+  parser.add_argument("-q", "--queue-size", type=int, default=64,
+                      help="max number of decoded files waiting for the ASR (default 64)")
+  parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+  parser.add_argument("-s", "--scores-file",
+                      help="write the utmos score of each file in this tsv file")
+  parser.add_argument("-c", "--cache-file",
+                      help="sqlite file with the cached transcriptions and utmos scores")
+  parser.add_argument("--cache-max-entries", type=int, default=1000000,
+                      help="max number of results kept in the cache (default 1000000)")
+  parser.add_argument("-r", "--resample-cache-dir",
+                      help="dir where the waves resampled to 16 kHz are cached")
+  parser.add_argument("--stats-file",
+                      help="write the number of files and of cache hits in this json file")
+  parser.add_argument("wav_dir")
+  args = parser.parse_args()
+  if args.debug:
+    DebugFlag = True
+
+  wavDir = args.wav_dir
+  fileList = [obj for obj in listdir(wavDir) if isfile(join(wavDir, obj))]
+  makedirs(args.output_dir, exist_ok=True)
+
+  pathList = [join(wavDir, f) for f in fileList]
+  asrModelId = f'whisper-{args.model}@beam5'
+  resList = []
+  needAsr = set(pathList)
+  needMos = set(pathList)
+  asrHits = 0
+  mosHits = 0
+  cache = None
+  hashDict = {}
+  if args.cache_file:
+    cache = ResultCache(args.cache_file, args.cache_max_entries)
+    with ThreadPoolExecutor(max_workers=args.num_workers) as pool:
+      hashDict = dict(zip(pathList, pool.map(hashFile, pathList)))
+    for f in pathList:
+      lineList = cache.get(hashDict[f], asrModelId, args.language)
+      if lineList is not None:
+        writeTranscription(args.output_dir, f, lineList)
+        needAsr.discard(f)
+        asrHits += 1
+      score = cache.get(hashDict[f], MosModelId)
+      if score is not None:
+        resList.append((f, score))
+        needMos.discard(f)
+        mosHits += 1
+    cache.touch()
+    debug(f'cache hits: asr {asrHits} utmos {mosHits} on {len(pathList)} files')
+
+  infoList = []
+  for f in pathList:
+    if f in needAsr or f in needMos:
+      n, sr = getAudioInfo(f)
+      infoList.append((f, n, sr))
+  # the sample rate of the decoded waves is always TargetSr
+  bucketList = makeBuckets([(f, n * TargetSr / sr, TargetSr) for f, n, sr in infoList],
+                           args.batch_size, args.max_pad_ratio)
+  debug(f'{len(infoList)} files to decode in {len(bucketList)} batches')
+
+  asrModel = None
+  predictor = None
+  if needAsr:
+    asrModel = loadWhisper(args.model, args.device)
+  if needMos:
+    predictor = loadUtmos(args.device)
+
+  asrQueue = queue.Queue(maxsize=args.queue_size)
+  mosQueue = queue.Queue(maxsize=max(1, args.queue_size // args.batch_size))
+  asrResList = []
+  mosResList = []
+  errorList = []
+  threadList = [
+    threading.Thread(target=asrConsumer,
+                     args=(asrModel, asrQueue, args.output_dir, args.language, args.device, asrResList, errorList)),
+    threading.Thread(target=mosConsumer,
+                     args=(predictor, mosQueue, args.device, mosResList, errorList)),
+  ]
+  for t in threadList:
+    t.start()
+  producer(bucketList, needAsr, needMos, asrQueue, mosQueue, args.num_workers,
+           args.resample_cache_dir, hashDict)
+  for t in threadList:
+    t.join()
+  if errorList:
+    raise errorList[0]
+  resList.extend(mosResList)
+
+  if cache is not None:
+    for f, lineList in asrResList:
+      cache.put(hashDict[f], asrModelId, lineList, args.language)
+    for f, score in mosResList:
+      cache.put(hashDict[f], MosModelId, score)
+    cache.close()
+
+  if args.stats_file:
+    with open(args.stats_file, "w") as fp:
+      json.dump({"files": len(pathList), "asr_cache_hits": asrHits,
+                 "utmos_cache_hits": mosHits}, fp)
+
+  if args.scores_file:
+    with open(args.scores_file, "w") as fp:
+      for f, s in resList:
+        print(f'{basename(f)}\t{s}', file=fp)
+
+  # compute mean and standard deviation of the utmos scores
+
+  scoreList = [s for _, s in resList]
+  mean  = statistics.mean(scoreList)
+  stdev = statistics.pstdev(scoreList)
+
+  print(f'{mean} {stdev}')
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+# persistent cache of the per-file results of the TTS evaluation (whisper
+# transcriptions and UTMOS scores) keyed by the hash of the audio content,
+# the model id and the language, so that the files already evaluated in a
+# previous submission do not go through the models again
+
+import json
+import time
+import sqlite3
+import hashlib
+
+
+def hashFile(audioF, blockSize=1 << 20):
+  h = hashlib.sha256()
+  with open(audioF, 'rb') as fp:
+    for block in iter(lambda: fp.read(blockSize), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+class ResultCache:
+  # sqlite db with a row for each (audio_hash, model, lang); when more than
+  # maxEntries rows are stored the least recently used ones are evicted.
+  # The writes are committed at once (get only collects the rows to touch,
+  # see touch), so that a job never holds the write lock of a shared cache
+  # file while its models run
+
+  def __init__(self, dbFile, maxEntries=1000000):
+    self.maxEntries = maxEntries
+    self.hits = 0
+    self.misses = 0
+    self.touchList = []
+    # several evaluations can share the same cache file
+    self.conn = sqlite3.connect(dbFile, timeout=60)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute(
+      "CREATE TABLE IF NOT EXISTS results ("
+      " audio_hash TEXT NOT NULL,"
+      " model TEXT NOT NULL,"
+      " lang TEXT NOT NULL,"
+      " value TEXT NOT NULL,"
+      " last_used REAL NOT NULL,"
+      " PRIMARY KEY (audio_hash, model, lang))")
+    self.conn.execute(
+      "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+    self.conn.commit()
+
+  def get(self, audioHash, model, lang=''):
+    row = self.conn.execute(
+      "SELECT value FROM results WHERE audio_hash=? AND model=? AND lang=?",
+      (audioHash, model, lang)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.touchList.append((audioHash, model, lang))
+    return json.loads(row[0])
+
+  def touch(self):
+    # update the last use of the rows read by get, in a single transaction
+    if self.touchList:
+      now = time.time()
+      self.conn.executemany(
+        "UPDATE results SET last_used=? WHERE audio_hash=? AND model=? AND lang=?",
+        [(now,) + key for key in self.touchList])
+      self.conn.commit()
+      self.touchList = []
+
+  def put(self, audioHash, model, value, lang=''):
+    self.conn.execute(
+      "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+      (audioHash, model, lang, json.dumps(value, ensure_ascii=False), time.time()))
+    self.conn.commit()
+
+  def evict(self):
+    cnt = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    if cnt > self.maxEntries:
+      self.conn.execute(
+        "DELETE FROM results WHERE rowid IN"
+        " (SELECT rowid FROM results ORDER BY last_used LIMIT ?)",
+        (cnt - self.maxEntries,))
+    return max(0, cnt - self.maxEntries)
+
+  def close(self):
+    self.touch()
+    self.evict()
+    self.conn.commit()
+    self.conn.close()
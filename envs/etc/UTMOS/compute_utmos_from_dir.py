@@ -2,36 +2,114 @@
 
 import sys
 import torch
-import librosa
 import argparse
 import statistics
 
 from os import listdir
-from os.path import isfile, join
+from os.path import isfile, join, basename, dirname, abspath
+from concurrent.futures import ThreadPoolExecutor
 
-parser = argparse.ArgumentParser()
-parser.add_argument("wav_dir")
-args = parser.parse_args()
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+from audio_io import getAudioInfo, loadAudio
+from model_registry import loadUtmos
 
-wavDir = args.wav_dir
-fileList = [obj for obj in listdir(wavDir) if isfile(join(wavDir, obj))]
 
-predictor = torch.hub.load("tarepan/SpeechMOS:v1.2.0", "utmos22_strong", trust_repo=True).cuda()
-scoreList = []
-for f in fileList:
-  audioF = join(wavDir, f)
-  wave, sr = librosa.load(audioF, sr=None, mono=True)
-  score = predictor(torch.from_numpy(wave).to("cuda").unsqueeze(0), sr)
-  utmos = float(score[0])
-  scoreList.append(utmos)
-  ## print(f'utmos {f} {utmos}')
+def debug(msg):
+  if DebugFlag:
+    print(f'{msg}', file=sys.stderr)
 
-# compute mean and standard deviation
 
-mean  = statistics.mean(scoreList)
-stdev = statistics.pstdev(scoreList)
+def makeBuckets(infoList, batchSize, maxPadRatio):
+  # infoList = [ (file, num_samples, sample_rate) ]
+  # sort the files by duration and group them in batches of files with the
+  # same sample rate whose lengths differ at most by maxPadRatio (so that the
+  # zero padding added to the shorter waves is negligible)
+  bucketList = []
+  bucket = []
+  for f, n, sr in sorted(infoList, key=lambda x: (x[2], x[1], x[0])):
+    if bucket:
+      _, n0, sr0 = bucket[0]
+      if len(bucket) >= batchSize or sr != sr0 or (n - n0) > maxPadRatio * n:
+        bucketList.append(bucket)
+        bucket = []
+    bucket.append((f, n, sr))
+  if bucket:
+    bucketList.append(bucket)
+  return bucketList
 
-print(f'{mean} {stdev}')
 
+def decodeBucket(bucket):
+  # decode the waves of a bucket and pad them to the longest one
+  waveList = []
+  for f, _, sr in bucket:
+    wave, _ = loadAudio(f)
+    waveList.append(wave)
+  maxLen = max(len(w) for w in waveList)
+  batch = torch.zeros(len(waveList), maxLen)
+  for i, w in enumerate(waveList):
+    batch[i, :len(w)] = torch.from_numpy(w)
+  return batch, bucket[0][2]
 
 
+def scoreBuckets(predictor, bucketList, device, numWorkers, prefetch):
+  # decode the buckets in a pool of threads while the model runs on the
+  # already decoded ones; return the list of (file, score)
+  resList = []
+  with ThreadPoolExecutor(max_workers=numWorkers) as pool:
+    futureList = [pool.submit(decodeBucket, b) for b in bucketList[:prefetch]]
+    for i, bucket in enumerate(bucketList):
+      if i + prefetch < len(bucketList):
+        futureList.append(pool.submit(decodeBucket, bucketList[i + prefetch]))
+      batch, sr = futureList[i].result()
+      futureList[i] = None
+      with torch.inference_mode():
+        scores = predictor(batch.to(device), sr)
+      for (f, _, _), s in zip(bucket, scores.tolist()):
+        resList.append((f, float(s)))
+        debug(f'utmos {f} {float(s)}')
+  return resList
+
+
+DebugFlag = False
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--debug", action="store_true")
+  parser.add_argument("-b", "--batch-size", type=int, default=16)
+  parser.add_argument("-p", "--max-pad-ratio", type=float, default=0.02,
+                      help="max fraction of zero padding in a batch (default 0.02)")
+  parser.add_argument("-w", "--num-workers", type=int, default=4,
+                      help="number of audio decoding threads (default 4)")
+  parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+  parser.add_argument("-s", "--scores-file",
+                      help="write the utmos score of each file in this tsv file")
+  parser.add_argument("wav_dir")
+  args = parser.parse_args()
+  if args.debug:
+    DebugFlag = True
+
+  wavDir = args.wav_dir
+  fileList = [obj for obj in listdir(wavDir) if isfile(join(wavDir, obj))]
+
+  infoList = []
+  for f in fileList:
+    n, sr = getAudioInfo(join(wavDir, f))
+    infoList.append((join(wavDir, f), n, sr))
+  bucketList = makeBuckets(infoList, args.batch_size, args.max_pad_ratio)
+  debug(f'{len(infoList)} files in {len(bucketList)} batches')
+
+  predictor = loadUtmos(args.device)
+  resList = scoreBuckets(predictor, bucketList, args.device, args.num_workers, 2 * args.num_workers)
+  scoreList = [s for _, s in resList]
+
+  if args.scores_file:
+    with open(args.scores_file, "w") as fp:
+      for f, s in resList:
+        print(f'{basename(f)}\t{s}', file=fp)
+
+  # compute mean and standard deviation
+
+  mean  = statistics.mean(scoreList)
+  stdev = statistics.pstdev(scoreList)
+
+  print(f'{mean} {stdev}')
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+# audio reading for the TTS evaluation:
+#  - PCM/float WAV files are read by parsing the header and memory-mapping
+#    the samples (no decoding, no copy until the float32 conversion)
+#  - the other formats fall back to soundfile/librosa
+#  - optional on-disk cache of the resampled waves (.npy, memory-mapped)
+
+import os
+import struct
+import hashlib
+import numpy as np
+
+from os.path import join, getsize, realpath
+
+
+# WAVE format tags
+WaveFormatPcm        = 0x0001
+WaveFormatFloat      = 0x0003
+WaveFormatExtensible = 0xFFFE
+
+
+class WavView:
+  # the samples of a WAV file as a memory-mapped array of shape
+  # (num_samples, num_channels) in the dtype stored in the file (24 bit
+  # samples are mapped as uint8 triplets)
+
+  def __init__(self, audioF, sr, numChannels, formatTag, bitsPerSample, dataOffset, dataSize):
+    self.audioF = audioF
+    self.sr = sr
+    self.numChannels = numChannels
+    self.formatTag = formatTag
+    self.bitsPerSample = bitsPerSample
+    sampleBytes = bitsPerSample // 8
+    self.numSamples = dataSize // (sampleBytes * numChannels)
+    if formatTag == WaveFormatFloat:
+      dtype = {4: '<f4', 8: '<f8'}[sampleBytes]
+    elif sampleBytes == 3:
+      dtype = 'u1'
+    else:
+      dtype = {1: 'u1', 2: '<i2', 4: '<i4'}[sampleBytes]
+    shape = (self.numSamples, numChannels, 3) if sampleBytes == 3 else (self.numSamples, numChannels)
+    if self.numSamples == 0:
+      self.samples = np.zeros(shape, dtype=dtype)
+    else:
+      # copy-on-write: the views are writable (e.g. for torch.from_numpy)
+      # but the file is never modified
+      self.samples = np.memmap(audioF, dtype=dtype, mode='c', offset=dataOffset, shape=shape)
+
+  def toFloat32(self, mono=True):
+    # same scaling of soundfile/librosa
+    x = self.samples
+    sampleBytes = self.bitsPerSample // 8
+    if self.formatTag == WaveFormatFloat:
+      if x.dtype != np.float32:
+        x = x.astype(np.float32)
+    elif sampleBytes == 1:
+      x = (x.astype(np.float32) - 128.0) / 128.0
+    elif sampleBytes == 2:
+      x = x.astype(np.float32) / 32768.0
+    elif sampleBytes == 3:
+      x = x.astype(np.int32)
+      x = (x[..., 0] << 8) | (x[..., 1] << 16) | (x[..., 2] << 24)
+      x = x.astype(np.float32) / 2147483648.0
+    else:
+      x = x.astype(np.float32) / 2147483648.0
+    if not mono:
+      return x.T
+    if self.numChannels == 1:
+      return x[:, 0]
+    return x.mean(axis=1, dtype=np.float32)
+
+
+def openWav(audioF):
+  # parse the RIFF/WAVE header; return a WavView or None if the file is not
+  # a PCM/float WAV file
+  try:
+    with open(audioF, 'rb') as fp:
+      riff = fp.read(12)
+      if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        return None
+      fmt = None
+      fileSize = getsize(audioF)
+      while True:
+        chunkHeader = fp.read(8)
+        if len(chunkHeader) < 8:
+          return None
+        chunkId, chunkSize = struct.unpack('<4sI', chunkHeader)
+        if chunkId == b'fmt ':
+          data = fp.read(chunkSize)
+          formatTag, numChannels, sr, _, _, bitsPerSample = struct.unpack('<HHIIHH', data[:16])
+          if formatTag == WaveFormatExtensible and len(data) >= 26:
+            # the first two bytes of the subformat GUID are the format tag
+            formatTag = struct.unpack('<H', data[24:26])[0]
+          fmt = (formatTag, numChannels, sr, bitsPerSample)
+        elif chunkId == b'data':
+          if fmt is None:
+            return None
+          formatTag, numChannels, sr, bitsPerSample = fmt
+          if formatTag not in (WaveFormatPcm, WaveFormatFloat):
+            return None
+          if formatTag == WaveFormatPcm and bitsPerSample not in (8, 16, 24, 32):
+            return None
+          if formatTag == WaveFormatFloat and bitsPerSample not in (32, 64):
+            return None
+          dataOffset = fp.tell()
+          # streamed WAV files can have a wrong data size
+          dataSize = min(chunkSize, fileSize - dataOffset)
+          return WavView(audioF, sr, numChannels, formatTag, bitsPerSample, dataOffset, dataSize)
+        if chunkId != b'fmt ':
+          fp.seek(chunkSize, os.SEEK_CUR)
+        if chunkSize % 2 == 1:
+          # chunks are word aligned
+          fp.seek(1, os.SEEK_CUR)
+  except (OSError, struct.error, KeyError):
+    return None
+
+
+def getAudioInfo(audioF):
+  # return (num_samples, sample_rate) without decoding the audio
+  wav = openWav(audioF)
+  if wav is not None:
+    return wav.numSamples, wav.sr
+  import soundfile as sf
+  try:
+    info = sf.info(audioF)
+    return info.frames, info.samplerate
+  except Exception:
+    import librosa
+    sr = librosa.get_samplerate(audioF)
+    return int(librosa.get_duration(path=audioF) * sr), sr
+
+
+def getCacheKey(audioF):
+  # identify a file by path, size and modification time (cheap); callers
+  # that already have the hash of the content should pass it instead
+  st = os.stat(audioF)
+  return hashlib.sha256(f'{realpath(audioF)}\t{st.st_size}\t{st.st_mtime_ns}'.encode()).hexdigest()
+
+
+def loadAudio(audioF, sr=None, cacheDir=None, audioKey=None):
+  # return (mono float32 wave, sample_rate) like librosa.load(audioF, sr=sr, mono=True);
+  # when sr is given and cacheDir is set the resampled wave is stored in
+  # cacheDir and memory-mapped in the next calls
+  cacheF = None
+  if sr is not None and cacheDir is not None:
+    cacheF = join(cacheDir, f'{audioKey or getCacheKey(audioF)}.{sr}.npy')
+    if os.path.isfile(cacheF):
+      return np.load(cacheF, mmap_mode='c'), sr
+  wav = openWav(audioF)
+  if wav is not None:
+    wave = wav.toFloat32()
+    origSr = wav.sr
+  else:
+    import librosa
+    wave, origSr = librosa.load(audioF, sr=None, mono=True)
+  if sr is None or sr == origSr:
+    return wave, origSr
+  import librosa
+  wave = librosa.resample(np.asarray(wave), orig_sr=origSr, target_sr=sr).astype(np.float32)
+  if cacheF is not None:
+    os.makedirs(cacheDir, exist_ok=True)
+    tmpF = f'{cacheF}.{os.getpid()}.tmp.npy'
+    np.save(tmpF, wave)
+    os.replace(tmpF, cacheF)
+  return wave, sr
@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+
+# local registry of the models used by the metrics, so that the evaluation
+# scripts load the weights from disk and never touch the network.
+#
+# The registry is a json file (default $MODEL_REGISTRY or
+# ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/CACHE/models/registry.json):
+#
+# { $METRIC : { $MODEL : { "path": $LOCAL_PATH,
+#                          "sha256": $CHECKSUM,
+#                          "size": $BYTES,
+#                          "mtime": $MTIME_NS,
+#                          ... metric specific fields ... }
+#             }
+# }
+#
+# It is filled by the warm-up command (run it in the env of each metric,
+# see DO_warmup_models.sh):
+#
+#   python model_registry.py warmup utmos
+#   python model_registry.py warmup whisper -m large
+#   python model_registry.py warmup comet -m Unbabel/wmt22-comet-da
+#   python model_registry.py warmup bertscore
+#   python model_registry.py verify
+#
+# When the registry file does not exist the loaders below fall back to the
+# usual hub/download functions.  Once it exists the evaluation is offline
+# for all the metrics (HF_HUB_OFFLINE): every model they load, e.g. the
+# BERTScore model of every target language of MCIF and IWSLT IF (see
+# BertscoreLangs, the default of the bertscore warm-up), must be registered,
+# otherwise the loader raises RegistryError.
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+from os.path import join, isdir, isfile, exists, dirname, basename
+
+
+DefaultRoot = join(os.environ.get("PLG_GROUPS_STORAGE", ""), "plggmeetween", "envs", "setup", "CACHE", "models")
+
+UtmosRepo = "tarepan/SpeechMOS:v1.2.0"
+UtmosModel = "utmos22_strong"
+
+# the target languages of MCIF and IWSLT IF (run-MCIF__athena.sh,
+# run-IWSLT2*-IF__athena.sh): add here a new one before evaluating it
+BertscoreLangs = ["en", "de", "it", "zh"]
+
+
+class RegistryError(RuntimeError):
+  pass
+
+
+def getRegistryFile():
+  return os.environ.get("MODEL_REGISTRY", join(DefaultRoot, "registry.json"))
+
+
+def isOffline():
+  return isfile(getRegistryFile()) and os.environ.get("MODEL_REGISTRY_WARMUP") != "1"
+
+
+if isOffline():
+  # must happen before transformers/huggingface_hub are imported, so import
+  # this module before bert_score and comet
+  os.environ.setdefault("HF_HUB_OFFLINE", "1")
+  os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+
+def debug(msg):
+  if DebugFlag:
+    print(f'{msg}', file=sys.stderr)
+
+
+def listFiles(path):
+  if isdir(path):
+    fileList = []
+    for d, _, names in os.walk(path, followlinks=True):
+      fileList.extend(join(d, n) for n in names)
+    return sorted(fileList)
+  return [path]
+
+
+def getSizeAndMtime(path):
+  size = 0
+  mtime = 0
+  for f in listFiles(path):
+    st = os.stat(f)
+    size += st.st_size
+    mtime = max(mtime, st.st_mtime_ns)
+  return size, mtime
+
+
+def sha256Path(path, blockSize=1 << 20):
+  # checksum of a file or of all the files (and their relative paths) of a dir
+  h = hashlib.sha256()
+  for f in listFiles(path):
+    if isdir(path):
+      h.update(os.path.relpath(f, path).encode())
+    with open(f, 'rb') as fp:
+      for block in iter(lambda: fp.read(blockSize), b''):
+        h.update(block)
+  return h.hexdigest()
+
+
+def loadRegistry():
+  registryF = getRegistryFile()
+  if not isfile(registryF):
+    return {}
+  with open(registryF) as fp:
+    return json.load(fp)
+
+
+def saveRegistry(registry):
+  registryF = getRegistryFile()
+  os.makedirs(dirname(registryF), exist_ok=True)
+  tmpF = f'{registryF}.{os.getpid()}.tmp'
+  with open(tmpF, 'w') as fp:
+    json.dump(registry, fp, indent=2)
+  os.replace(tmpF, registryF)
+
+
+def registerModel(registry, metric, model, path, **extra):
+  size, mtime = getSizeAndMtime(path)
+  entry = {"path": path, "sha256": sha256Path(path), "size": size, "mtime": mtime}
+  entry.update(extra)
+  registry.setdefault(metric, {})[model] = entry
+  debug(f'registered {metric} {model} {path} {entry["sha256"]}')
+  return entry
+
+
+def checkEntry(metric, model, entry, verify=False):
+  path = entry["path"]
+  if not exists(path):
+    raise RegistryError(f'{metric} {model}: cannot find {path}')
+  size, mtime = getSizeAndMtime(path)
+  if size != entry["size"]:
+    raise RegistryError(f'{metric} {model}: wrong size of {path}')
+  # the full checksum is computed only if asked or if the files were touched
+  if verify or mtime != entry["mtime"]:
+    if sha256Path(path) != entry["sha256"]:
+      raise RegistryError(f'{metric} {model}: wrong checksum of {path}')
+
+
+def resolveModel(metric, model, verify=False):
+  registry = loadRegistry()
+  if model not in registry.get(metric, {}):
+    raise RegistryError(f'{metric} {model} is not in the registry {getRegistryFile()}'
+                        f' (run: python model_registry.py warmup {metric})')
+  entry = registry[metric][model]
+  checkEntry(metric, model, entry, verify)
+  return entry
+
+
+# -------
+# loaders
+# -------
+
+def loadUtmos(device="cpu"):
+  import torch
+  if not isOffline():
+    return torch.hub.load(UtmosRepo, UtmosModel, trust_repo=True).to(device).eval()
+  entry = resolveModel("utmos", UtmosModel)
+  model = torch.hub.load(entry["repo"], UtmosModel, source="local", pretrained=False)
+  try:
+    stateDict = torch.load(entry["path"], map_location="cpu", mmap=True, weights_only=True)
+  except TypeError:
+    # torch < 2.1
+    stateDict = torch.load(entry["path"], map_location="cpu")
+  model.load_state_dict(stateDict)
+  return model.to(device).eval()
+
+
+def loadWhisper(model, device="cpu"):
+  import whisper
+  if not isOffline():
+    return whisper.load_model(model, device=device)
+  # loading from a file path skips the download (and its checksum)
+  return whisper.load_model(resolveModel("whisper", model)["path"], device=device)
+
+
+def getCometCheckpoint(model):
+  if not isOffline():
+    from comet import download_model
+    return download_model(model)
+  return resolveModel("comet", model)["path"]
+
+
+def getBertscoreArgs(lang):
+  # kwargs of bert_score.score() for the language lang
+  args = {"lang": lang, "rescale_with_baseline": True}
+  if isOffline():
+    # no download in offline mode: lang must be in BertscoreLangs
+    if lang not in loadRegistry().get("bertscore", {}):
+      raise RegistryError(f'bertscore {lang} is not in the registry {getRegistryFile()}'
+                          f' (add it to BertscoreLangs and run DO_warmup_models.sh, or run:'
+                          f' python model_registry.py warmup bertscore -l {lang})')
+    entry = resolveModel("bertscore", lang)
+    args["model_type"] = entry["path"]
+    args["num_layers"] = entry["num_layers"]
+    args["baseline_path"] = entry["baseline_path"]
+  return args
+
+
+# -------
+# warm-up
+# -------
+
+def warmupUtmos(registry, root):
+  import torch
+  model = torch.hub.load(UtmosRepo, UtmosModel, trust_repo=True)
+  repoDir = join(torch.hub.get_dir(), UtmosRepo.replace("/", "_").replace(":", "_"))
+  weightF = join(root, "utmos", f'{UtmosModel}.pt')
+  os.makedirs(dirname(weightF), exist_ok=True)
+  torch.save(model.state_dict(), weightF)
+  registerModel(registry, "utmos", UtmosModel, weightF, repo=repoDir)
+
+
+def warmupWhisper(registry, root, modelList):
+  import whisper
+  for model in modelList:
+    whisper.load_model(model, device="cpu", download_root=join(root, "whisper"))
+    modelF = join(root, "whisper", basename(whisper._MODELS[model]))
+    registerModel(registry, "whisper", model, modelF)
+
+
+def warmupComet(registry, root, modelList):
+  from comet import download_model, load_from_checkpoint
+  for model in modelList:
+    modelF = download_model(model, saving_directory=join(root, "comet", model.replace("/", "_")))
+    registerModel(registry, "comet", model, modelF)
+    # stage in the HF cache the encoder config/tokenizer needed by the checkpoint
+    load_from_checkpoint(modelF)
+
+
+def warmupBertscore(registry, root, langList):
+  import bert_score
+  from bert_score.utils import lang2model, model2layers
+  from huggingface_hub import snapshot_download
+  for lang in langList:
+    name = lang2model[lang.lower()]
+    modelDir = snapshot_download(name, cache_dir=join(root, "hf"))
+    baselineF = join(dirname(bert_score.__file__), "rescale_baseline", lang.lower(), f'{name}.tsv')
+    registerModel(registry, "bertscore", lang, modelDir, name=name,
+                  num_layers=model2layers[name], baseline_path=baselineF)
+
+
+DebugFlag = False
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("-d", "--debug", action="store_true")
+  parser.add_argument("-r", "--root", default=DefaultRoot, help="dir where the models are staged")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  wp = subparsers.add_parser("warmup", help="download the models of a metric and register them")
+  wp.add_argument("metric", choices=["utmos", "whisper", "comet", "bertscore"])
+  wp.add_argument("-m", "--models", nargs="+", default=[])
+  wp.add_argument("-l", "--langs", nargs="+", default=[])
+  subparsers.add_parser("verify", help="check the checksums of all the registered models")
+  subparsers.add_parser("list", help="print the registry")
+  args = parser.parse_args()
+  if args.debug:
+    DebugFlag = True
+
+  if args.command == "warmup":
+    if os.environ.get("MODEL_REGISTRY_WARMUP") != "1":
+      print('set MODEL_REGISTRY_WARMUP=1 to run the warm-up (the network must be enabled)', file=sys.stderr)
+      sys.exit(1)
+    registry = loadRegistry()
+    if args.metric == "utmos":
+      warmupUtmos(registry, args.root)
+    elif args.metric == "whisper":
+      warmupWhisper(registry, args.root, args.models or ["large"])
+    elif args.metric == "comet":
+      warmupComet(registry, args.root, args.models or ["Unbabel/wmt22-comet-da"])
+    elif args.metric == "bertscore":
+      warmupBertscore(registry, args.root, args.langs or BertscoreLangs)
+    saveRegistry(registry)
+  elif args.command == "verify":
+    errCnt = 0
+    for metric, d in loadRegistry().items():
+      for model, entry in d.items():
+        try:
+          checkEntry(metric, model, entry, verify=True)
+          print(f'OK     {metric} {model}')
+        except RegistryError as e:
+          print(f'ERROR  {e}')
+          errCnt += 1
+    sys.exit(1 if errCnt else 0)
+  else:
+    print(json.dumps(loadRegistry(), indent=2))
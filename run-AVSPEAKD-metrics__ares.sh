@@ -4,6 +4,7 @@
 #SBATCH -p plgrid
 #SBATCH -N 1
 #SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=8
 #SBATCH --mem=10G
 #SBATCH --job-name=ram
 
@@ -13,10 +14,13 @@
 
 show_help() {
   cat << EOF
-ARGS: [-h] [-v] lang hypTsvFile refTsvFile
+ARGS: [-h] [-v] [-b breakdownFile] [-c collar] [-t thresholds] lang hypTsvFile refTsvFile
   where
       -h        print help
       -v        verbose
+      -b        write the scores of each video and speaker in breakdownFile (json)
+      -c        collar (in seconds, e.g. 0.25) around the reference speech boundaries
+      -t        comma separated thresholds (e.g. 0.3,0.5,0.7) of the precision/recall/F1 sweep
 EOF
 }
 
@@ -25,9 +29,9 @@ EOF
 OPTIND=1         # Reset in case getopts has been used previously in the shell.
 
 # Initialize our own variables:
-args=''
+args="-j ${SLURM_CPUS_PER_TASK:-1}"
 
-while getopts "hv" opt; do
+while getopts "hvb:c:t:" opt; do
   case "$opt" in
     h)
       show_help
@@ -36,6 +40,15 @@ while getopts "hv" opt; do
     v)
       args="$args -d"
       ;;
+    b)
+      args="$args -b $OPTARG"
+      ;;
+    c)
+      args="$args -c $OPTARG"
+      ;;
+    t)
+      args="$args -t $OPTARG"
+      ;;
   esac
 done
 
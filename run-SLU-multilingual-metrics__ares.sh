@@ -0,0 +1,98 @@
+#! /bin/bash
+
+#SBATCH -A plgmeetween2026-cpu
+#SBATCH -p plgrid
+#SBATCH -N 1
+#SBATCH --ntasks-per-node=1
+#SBATCH --cpus-per-task=8
+#SBATCH --mem=8G
+#SBATCH --job-name=slu
+#SBATCH --time 72:00:00
+
+# -----------
+# manage args
+# -----------
+
+print_if_verbose() {
+  if test $verbose -eq 1 ; then echo "$@" 1>&2 ; fi
+}
+
+show_help() {
+  cat << EOF
+ARGS: [-h] [-v] [-j jobs] batchFile
+  where
+      -h        print help
+      -v        verbose
+      -j        number of parallel workers (default: the cpus of the job)
+      batchFile tsv file with a line for each locale: locale hypFile refFile
+EOF
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+verbose=0
+debugInfo=""
+jobs=${SLURM_CPUS_PER_TASK:-1}
+
+while getopts "hvj:" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    v)
+      verbose=1
+      debugInfo='-d'
+      ;;
+    j)
+      jobs=$OPTARG
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+[ "${1:-}" = "--" ] && shift
+
+test "$#" -ge 1 || { show_help ; exit 1 ; }
+batch=$1
+shift 1
+
+test -f "$batch" || { echo cannot find batchFile $batch ; exit 1 ; }
+while IFS=$'\t' read -r locale hyp ref ; do
+  test -z "$locale" && continue
+  test -f "$hyp" || { echo cannot find hyp $hyp of $locale ; exit 1 ; }
+  test -f "$ref" || { echo cannot find ref $ref of $locale ; exit 1 ; }
+done < $batch
+
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/slu.USE
+exe=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/SLU/slu_eval.py
+
+
+tmpPrefix=/tmp/rSmr.$$
+tmpScores=${tmpPrefix}.scores
+tmpFinal=${tmpPrefix}.final
+
+print_if_verbose "scoring the locales of $batch with $jobs jobs"
+python3 $exe $debugInfo -j $jobs -b $batch 2> /dev/null 1> $tmpScores
+
+if test $? != 0
+then
+  exitFlag=1
+  state=ERROR
+  reason=UNKNOWN
+  printf '{"state": "%s", "reason": "%s", "scores": {}}\n' $state $reason > $tmpFinal
+else
+  exitFlag=0
+  state=OK
+  printf '{"state": "%s", "scores": ' $state > $tmpFinal
+  printf '%s' "$(<$tmpScores)" >> $tmpFinal
+  echo '}' >> $tmpFinal
+fi
+
+cat $tmpFinal
+
+rm -f ${tmpPrefix}.*
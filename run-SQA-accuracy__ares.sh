@@ -18,10 +18,16 @@ print_if_verbose() {
 
 show_help() {
   cat << EOF
-ARGS: [-h] [-v] lang hypFile refFile
+ARGS: [-h] [-v] [-l] [-b] [-t] [-c concurrency] [-w width] lang hypFile refFile
   where
       -h        print help
       -v        verbose
+      -l        judge the exact matches (correct) and the empty answers (incorrect) without the LLM
+      -b        judge all the questions of a paragraph in a single request
+      -t        add the judge telemetry (latency percentiles, tokens, retries) to the scores
+      -c        max number of judge requests in flight (default 8)
+      -w        preview: judge a random sample until the 95% confidence interval
+                of the accuracy is narrower than width (accuracy points, e.g. 5)
       lang      two-digit language code
       hypFile   json file with answer predictions
       refFile   json file with questtion-answer references
@@ -35,8 +41,13 @@ OPTIND=1         # Reset in case getopts has been used previously in the shell.
 # Initialize our own variables:
 verbose=0
 debugInfo=""
+concurrency=8
+lexical=""
+batch=""
+preview=""
+telemetry=""
 
-while getopts "hv" opt; do
+while getopts "hvlbtc:w:" opt; do
   case "$opt" in
     h)
       show_help
@@ -46,6 +57,21 @@ while getopts "hv" opt; do
       verbose=1
       debugInfo='-d'
       ;;
+    l)
+      lexical='-l'
+      ;;
+    b)
+      batch='-b'
+      ;;
+    t)
+      telemetry='-t'
+      ;;
+    c)
+      concurrency=$OPTARG
+      ;;
+    w)
+      preview="-w $OPTARG"
+      ;;
   esac
 done
 
@@ -71,7 +97,11 @@ source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/groq.USE
 ## exe=/net/people/plgrid/plgcattoni/eval/SQA/run-SQA-accuracy.py
 exe=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/SQA-accuracy/run-SQA-accuracy.py
 
-python $exe $debugInfo -p $hyp -r $ref -o $outTmp 2>/dev/null 1>$tmpScores
+# verdicts of the answers already judged in the previous submissions
+# (keyed by context, question, normalized answer, model and prompt version)
+cacheFile=${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/CACHE/sqa_judge.sqlite
+
+python $exe $debugInfo $lexical $batch $preview $telemetry -c $concurrency --cache-file $cacheFile -p $hyp -r $ref -o $outTmp 2>/dev/null 1>$tmpScores
 
 if test $? != 0
 then
@@ -11,8 +11,9 @@
 
 # script for the evaluation of TTS
 #  1) args: wav_dir ref_tsv
-#  2) transcribe with wishper the waves and compute the WER wrt the ref_tsv
-#  3) compute UTMOS on each wav and get the average
+#  2) transcribe with wishper the waves and compute UTMOS on each wav
+#     (in a single pass over the waves)
+#  3) compute the WER wrt the ref_tsv and get the averages
 
 
 # get the wer score from a json string (e.g. '{"scores": {"wer": 1.2345}}')
@@ -74,23 +75,41 @@ tmpPrefix=/tmp/rtwu.$$
 
 
 # ----------------------------
-# transcribe with wishper the waves
+# transcribe with wishper and compute the UTMOS score of the waves
+# (each wav is decoded only once and shared by the two models)
 
-source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/whisper.USE
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/tts.USE
 
 traDir=${tmpPrefix}.transcriptions
 singleRef=${tmpPrefix}.ref
 werListFile=${tmpPrefix}.wer
+utmosListFile=${tmpPrefix}.utmos
+statsFile=${tmpPrefix}.stats
 
-exe1=whisper
+# transcriptions and UTMOS scores of the waves already evaluated
+# (keyed by audio content, model and language)
+cacheFile=${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/CACHE/tts_results.sqlite
+
+exe1=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/TTS/transcribe_and_score.py
 model=large
-task=transcribe
 
-args="--task $task --language $lang --model $model"
-args="$args --output_format txt --output_dir $traDir"
+args="--language $lang --model $model --output-dir $traDir --scores-file $utmosListFile"
+args="$args --cache-file $cacheFile --stats-file $statsFile"
+if test $verbose -eq 1 ; then args="$args -d" ; fi
 
 exe2=${PLG_GROUPS_STORAGE}/plggmeetween/evaluation/run-wer__ares.sh
 
+if test $verbose -eq 1 ; then echo before $exe1 1>&2 ; fi
+if test $verbose -eq 1
+then
+  utmosInfo=$(python $exe1 $args $wavD)
+else
+  utmosInfo=$(python $exe1 $args $wavD 2>/dev/null)
+fi
+if test $verbose -eq 1 ; then echo "after $exe1 : utmosInfo |$utmosInfo|" 1>&2 ; fi
+uMean=$(echo $utmosInfo | awk '{print $1}')
+uStdev=$(echo $utmosInfo | awk '{print $2}')
+
 
 # ----------------------------
 # compute the WER score for all the transcriptions (mean and standard deviation)
@@ -99,16 +118,12 @@ exe2=${PLG_GROUPS_STORAGE}/plggmeetween/evaluation/run-wer__ares.sh
 for w in ${wavD}/*.wav
 do
   b=$(basename $w .wav)
-  if test $verbose -eq 1 ; then
-    echo doing $exe1 $w $args 1>&2
-  fi
-  $exe1 $w $args &>/dev/null
   traF=${traDir}/${b}.txt
   # computing single WER
   grep "$b" $refF | cut -f2 > $singleRef
   bash $exe2 -g $lang $traF $singleRef | get_wer_score_from_json >> $werListFile
   if test $verbose -eq 1 ; then
-    echo wer $(tail -1 $werListFile) 1>&2
+    echo wer $b $(tail -1 $werListFile) 1>&2
   fi
 done
 
@@ -117,28 +132,17 @@ wMean=$(echo $werInfo | awk '{print $1}')
 wStdev=$(echo $werInfo | awk '{print $2}')
 
 
-# ----------------------------
-# compute the UTMOS score for all the wav files (mean and standard deviation)
-
-exe3=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/UTMOS/compute_utmos_from_dir.sh
-
-if test $verbose -eq 1 ; then echo before $exe3 1>&2 ; fi
-utmosInfo=$($exe3 $wavD)
-if test $verbose -eq 1 ; then echo "after $exe3 : utmosInfo |$utmosInfo|" 1>&2 ; fi
-uMean=$(echo $utmosInfo | awk '{print $1}')
-uStdev=$(echo $utmosInfo | awk '{print $2}')
-
-
 # -------------------------------
 # print the scores in json format
 #
 exitFlag=0
 state=OK
-printf '{"state": "%s", "scores": {"wer_mean": %s, "wer_standard_deviation": %s, "utmos_mean": %s, "utmos_standard_deviation": %s}}\n' $state $wMean $wStdev $uMean $uStdev
+test -s $statsFile || echo '{}' > $statsFile
+printf '{"state": "%s", "scores": {"wer_mean": %s, "wer_standard_deviation": %s, "utmos_mean": %s, "utmos_standard_deviation": %s}, "info": %s}\n' $state $wMean $wStdev $uMean $uStdev "$(<$statsFile)"
 
 # -----------
 # clean files
 
-\rm -rf  ${traDir} $singleRef $werListFile $tmpPrefix
+\rm -rf  ${traDir} $singleRef $werListFile $utmosListFile $statsFile $tmpPrefix
 
 
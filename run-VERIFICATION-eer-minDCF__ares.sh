@@ -0,0 +1,100 @@
+#! /bin/bash
+
+#SBATCH -A plgmeetween2026-cpu
+#SBATCH -p plgrid
+#SBATCH -N 1
+#SBATCH --ntasks-per-node=1
+#SBATCH --mem=4G
+#SBATCH --job-name=ver
+#SBATCH --time 72:00:00
+
+# -----------
+# manage args
+# -----------
+
+print_if_verbose() {
+  if test $verbose -eq 1 ; then echo "$@" 1>&2 ; fi
+}
+
+show_help() {
+  cat << EOF
+ARGS: [-h] [-v] [-p pTarget] lang scoreFile keyFile
+  where
+      -h        print help
+      -v        verbose
+      -p        prior of the target trials of the minDCF (default 0.01)
+      lang      two-digit language code (not used)
+      scoreFile txt file with a line for each trial: trial score
+      keyFile   txt file with a line for each trial: trial label (target|nontarget)
+EOF
+}
+
+
+# A POSIX variable
+OPTIND=1         # Reset in case getopts has been used previously in the shell.
+
+# Initialize our own variables:
+verbose=0
+debugInfo=""
+pTarget=0.01
+
+while getopts "hvp:" opt; do
+  case "$opt" in
+    h)
+      show_help
+      exit 0
+      ;;
+    v)
+      verbose=1
+      debugInfo='-d'
+      ;;
+    p)
+      pTarget=$OPTARG
+      ;;
+  esac
+done
+
+shift $((OPTIND-1))
+
+[ "${1:-}" = "--" ] && shift
+
+test "$#" -ge 3 || { show_help ; exit 1 ; }
+lang=$1
+hyp=$2
+ref=$3
+shift 3
+
+test -f "$hyp" || { echo cannot find scoreFile $hyp ; exit 1 ; }
+test -f "$ref" || { echo cannot find keyFile $ref ; exit 1 ; }
+
+source ${PLG_GROUPS_STORAGE}/plggmeetween/envs/setup/slu.USE
+exe=${PLG_GROUPS_STORAGE}/plggmeetween/envs/etc/SLU/verification_eval.py
+
+
+tmpPrefix=/tmp/rVer.$$
+tmpScores=${tmpPrefix}.scores
+tmpErr=${tmpPrefix}.err
+tmpFinal=${tmpPrefix}.final
+
+python3 $exe $debugInfo -p $pTarget $hyp $ref 2> $tmpErr 1> $tmpScores
+
+if test $? != 0
+then
+  exitFlag=1
+  state=ERROR
+  reason=UNKNOWN
+  score=UNKNOWN
+  print_if_verbose "$(<$tmpErr)"
+  printf '{"state": "%s", "reason": "%s", "scores": {"eer": "%s", "min_dcf": "%s"}}\n' $state $reason $score $score > $tmpFinal
+else
+  exitFlag=0
+  state=OK
+  print_if_verbose "$(<$tmpErr)"
+  printf '{"state": "%s", "scores": ' $state > $tmpFinal
+  printf '%s' "$(<$tmpScores)" >> $tmpFinal
+  echo '}' >> $tmpFinal
+fi
+
+cat $tmpFinal
+
+rm -f ${tmpPrefix}.*